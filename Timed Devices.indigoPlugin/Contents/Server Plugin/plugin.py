@@ -7,9 +7,28 @@ import indigo # noqa
 import threading
 import queue
 import time
-from datetime import datetime, timedelta
+import ast
+import operator
+import os
+import csv
+import json
+import sys
+import io
+import cProfile
+import pstats
+import functools
+import heapq
+import itertools
+import math
+import calendar
+import mmap
+import bisect
+import struct
+import tracemalloc
+from array import array
+from datetime import datetime, timedelta, date
 from ast import literal_eval
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -19,6 +38,8 @@ from collections import OrderedDict
 
 k_commonTrueStates = ['true', 'on', 'open', 'up', 'yes', 'active', 'locked']
 
+k_commonFalseStates = ['false', 'off', 'closed', 'down', 'no', 'inactive', 'unlocked', '']
+
 k_stateImages = {
     'SensorOff':    indigo.kStateImageSel.SensorOff,
     'TimerOff':     indigo.kStateImageSel.TimerOff,
@@ -80,17 +101,119 @@ k_periodRange = {
     'c': 2,
     }
 
+# position of each span in a packed SpanValues, and where its slots start in a packed SpanHistory
+k_spanIndex = {span:i for i, span in enumerate(k_timeSpans)}
+
+k_spanOffsets = {span:sum(k_periodRange[prior] for prior in list(k_timeSpans)[:i]) for i, span in enumerate(k_timeSpans)}
+
+k_cycleSpans = ('h', 'd', 'w', 'm', 'y')
+
+# user defined running timer spans, and the most slots each can keep
+k_customSpans = ('x1', 'x2')
+
+k_customRange = 36
+
+# completed running timer spans are appended here when a timer archives its spans
+k_archiveFolder = '~/Documents/Timed Devices Archive'
+
+k_weekdays = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+# event capture files: magic at the start of each file, then records of
+# time, input id, kind (0 device, 1 variable) and lengths of key, old and new value reprs
+k_captureMagic  = b'TDCAP1\n'
+k_captureRecord = struct.Struct('<dqBBHH')
+
+# most captured bytes held between flushes, records beyond this are dropped and counted
+k_captureBuffer = 1 << 20
+
+k_cycleFields = ('count', 'total', 'min', 'max')
+
+k_sequenceSteps = 5
+
+k_expressionOps = {
+    ast.And:    lambda *values: all(values),
+    ast.Or:     lambda *values: any(values),
+    ast.Not:    operator.not_,
+    ast.USub:   operator.neg,
+    ast.UAdd:   operator.pos,
+    ast.Add:    operator.add,
+    ast.Sub:    operator.sub,
+    ast.Mult:   operator.mul,
+    ast.Div:    operator.truediv,
+    ast.Mod:    operator.mod,
+    ast.Eq:     operator.eq,
+    ast.NotEq:  operator.ne,
+    ast.Gt:     operator.gt,
+    ast.Lt:     operator.lt,
+    ast.GtE:    operator.ge,
+    ast.LtE:    operator.le,
+    }
+
+k_timerTypes = (
+    'activityTimer',
+    'thresholdTimer',
+    'persistenceTimer',
+    'lockoutTimer',
+    'aliveTimer',
+    'runningTimer',
+    'sequenceTimer',
+    'runningAggregate',
+    )
+
+# columns of a timer definition file that are not config settings
+k_provisionKeys = ('name', 'type', 'folder')
+
+# changing these requires restarting the timer
+k_coldProps = ('logicType', 'valueType', 'trackEntity', 'cycleStats', 'expression', 'countMode',
+    'stateProfile', 'stateStrings', 'stateLegacy') + tuple(f'stateSlots{name}' for name in k_timeSpans.values()) \
+    + ('windowEnabled', 'windowStartType', 'windowStartTime', 'windowStartOffset', 'windowEndType', 'windowEndTime', 'windowEndOffset') \
+    + tuple(f'custom{field}{n+1}' for n in range(len(k_customSpans)) for field in ('Rule', 'Name', 'Anchor', 'Period', 'Slots'))
+
+# settings a shadow timer can't override, because the live timer's inputs and filtering are shared
+k_shadowFixedProps = tuple(key for pair in k_deviceKeys for key in pair) + k_variableKeys \
+    + ('ingestPolicy', 'ingestSeconds', 'members') + tuple(key for key in k_coldProps if key not in ['logicType', 'valueType'])
+
+# running timer state profiles: slots per span, string states, legacy states
+k_stateProfiles = {
+    'full':  (dict(k_periodRange), True, True),
+    'daily': ({'d':2}, True, False),
+    }
+
 k_tickSeconds = 1
 
+# records kept in each timer's trace buffer
+k_traceSize = 200
+
+# throwaway timers of each type built while measuring memory, see logMemoryUse
+k_memorySamples = 20
+
+# functions logged when a profile window closes
+k_profileLines = 25
+
+# from python 3.12 one enabled profile sees every thread, before that each thread needs its own
+k_sharedProfile = sys.version_info >= (3, 12)
+
 k_strftimeFormat = '%Y-%m-%d %H:%M:%S'
 
+# epoch time of the J2000 reference, noon UTC on 2000-01-01
+k_j2000 = 946728000
+
+################################################################################
+def profiled(method):
+    """Collect the method into the plugin's profile while a window is open"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profiler = getattr(self, 'plugin', self).profiler
+        if profiler and profiler.open():
+            return profiler.runcall(method, self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
 ################################################################################
 class Plugin(indigo.PluginBase):
     #-------------------------------------------------------------------------------
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
-        self.configDeviceList = list()
-        self.configVariableList = list()
 
     def __del__(self):
         indigo.PluginBase.__del__(self)
@@ -100,6 +223,8 @@ class Plugin(indigo.PluginBase):
     #-------------------------------------------------------------------------------
     def startup(self):
         self.showTimer  = self.pluginPrefs.get('showTimer',False)
+        self.batchWrites = self.pluginPrefs.get('batchWrites',False)
+        self.archiveFolder = os.path.expanduser(self.pluginPrefs.get('archiveFolder',k_archiveFolder))
         self.debug      = self.pluginPrefs.get('showDebugInfo',False)
         self.verbose    = self.pluginPrefs.get('verboseDebug',False) and self.debug
         self.logger.debug('startup')
@@ -109,6 +234,40 @@ class Plugin(indigo.PluginBase):
         self.deviceDict = dict()
         self.tickTime   = time.time()
 
+        # (timer id -> downstream timers, timer id -> their ids), built lazily when timers start or stop
+        # timer threads reset these to None, so readers take one reference and use only that
+        self.dependents = None
+
+        # (input id -> interned predicates, ids of the timers they serve, input id -> watched state keys
+        # (None for variables) of every running timer), built lazily like dependents
+        self.predicates = None
+        # (input id, state key) + comparison -> predicate of the last build, kept across resets
+        self.interned   = dict()
+
+        # timer id -> [dev, {state key: value}, state image] held for the next tick's batch, see queueWrite
+        self.pendingWrites = dict()
+        self.writeLock     = threading.Lock()
+
+        # (event id, timer id) -> triggers, timer id 0 matches any timer
+        self.triggerDict = dict()
+
+        # open cProfile window, see startProfile
+        self.profiler = None
+
+        # running event capture, see startCapture
+        self.capture = None
+
+        # (due time, sequence, timer) heap of active window boundaries, see scheduleWindow
+        # pushed to by deviceStartComm on the main thread and by tickTimers, so held under windowLock
+        self.windowQueue = list()
+        self.windowCount = itertools.count()
+        self.windowLock  = threading.Lock()
+        self.location    = None
+
+        # names, folders and state keys for config dialog lists, loaded on first use
+        self.deviceIndex   = EntityIndex(indigo.devices)
+        self.variableIndex = EntityIndex(indigo.variables)
+
         indigo.devices.subscribeToChanges()
         indigo.variables.subscribeToChanges()
 
@@ -118,12 +277,18 @@ class Plugin(indigo.PluginBase):
         self.pluginPrefs['showDebugInfo']   = self.debug
         self.pluginPrefs['verboseDebug']    = self.verbose
         self.pluginPrefs['showTimer']       = self.showTimer
+        self.flushWrites()
+        if self.capture:
+            self.capture.close()
 
     #-------------------------------------------------------------------------------
     def validatePrefsConfigUi(self, valuesDict):
         self.logger.debug('validatePrefsConfigUi')
         errorsDict = indigo.Dict()
 
+        if not valuesDict.get('archiveFolder','').strip():
+            errorsDict['archiveFolder'] = "Required"
+
         if len(errorsDict) > 0:
             self.logger.debug(f'validate prefs config error: \n{errorsDict}')
             return (False, valuesDict, errorsDict)
@@ -136,6 +301,8 @@ class Plugin(indigo.PluginBase):
             self.debug     = valuesDict.get('showDebugInfo',False)
             self.verbose   = valuesDict.get('verboseDebug',False) and self.debug
             self.showTimer = valuesDict.get('showTimer',True)
+            self.batchWrites = valuesDict.get('batchWrites',False)
+            self.archiveFolder = os.path.expanduser(valuesDict.get('archiveFolder',k_archiveFolder))
             if self.debug:
                 self.logger.debug('Debug logging enabled')
 
@@ -144,19 +311,49 @@ class Plugin(indigo.PluginBase):
         try:
             while True:
                 self.tickTime = time.time()
-                for device in self.deviceDict.values():
-                    device.doTask('tick')
+                self.tickTimers()
+                if self.pendingWrites:
+                    self.flushWrites()
+                # stopCapture may swap the capture out from the main thread
+                capture = self.capture
+                if capture:
+                    capture.flush()
+                if self.profiler and self.profiler.finished(self.tickTime):
+                    self.finishProfile()
                 self.sleep(self.tickTime + k_tickSeconds - time.time())
         except self.StopThread:
             pass    # Optionally catch the StopThread exception and do any needed cleanup.
 
+    #-------------------------------------------------------------------------------
+    @profiled
+    def tickTimers(self):
+        while True:
+            with self.windowLock:
+                if not (self.windowQueue and self.windowQueue[0][0] <= self.tickTime):
+                    break
+                due, seq, device = heapq.heappop(self.windowQueue)
+            if self.deviceDict.get(device.id) is device:
+                self.scheduleWindow(device)
+        for device in self.deviceDict.values():
+            device.flushIngest(self.tickTime)
+            device.doTask('tick')
+
     #-------------------------------------------------------------------------------
     # Device Methods
     #-------------------------------------------------------------------------------
     def deviceStartComm(self, dev):
+        if dev.id in self.deviceDict:
+            # already started by importTimers
+            return
         if dev.version != self.pluginVersion:
             self.updateDeviceVersion(dev)
+        if dev.deviceTypeId == 'runningTimer':
+            # optional states depend on device config
+            dev.stateListOrDisplayStateIdChanged()
+            dev.refreshFromServer()
         if dev.configured:
+            # states before the timer's first update, which happens while it is being built
+            oldDev = DeviceSnapshot(dev, dev.states)
             if dev.deviceTypeId == 'activityTimer':
                 self.deviceDict[dev.id] = ActivityTimer(dev, self)
             elif dev.deviceTypeId == 'thresholdTimer':
@@ -169,8 +366,20 @@ class Plugin(indigo.PluginBase):
                 self.deviceDict[dev.id] = AliveTimer(dev, self)
             elif dev.deviceTypeId == 'runningTimer':
                 self.deviceDict[dev.id] = RunningTimer(dev, self)
+            elif dev.deviceTypeId == 'sequenceTimer':
+                self.deviceDict[dev.id] = SequenceTimer(dev, self)
+            elif dev.deviceTypeId == 'runningAggregate':
+                self.deviceDict[dev.id] = RunningAggregate(dev, self)
+            if self.deviceDict[dev.id].window:
+                self.scheduleWindow(self.deviceDict[dev.id], initial=True)
+            self.dependents = None
+            self.predicates = None
+            # unregistered timers don't propagate, so hand the first update on now it is in deviceDict
+            if self.getDependents(dev.id)[0]:
+                self.propagate(dev.id, oldDev, DeviceSnapshot(dev, self.deviceDict[dev.id].states))
             # start the thread
             self.deviceDict[dev.id].start()
+            self.refreshAggregates(dev)
 
     #-------------------------------------------------------------------------------
     def deviceStopComm(self, dev):
@@ -179,6 +388,48 @@ class Plugin(indigo.PluginBase):
             while self.deviceDict[dev.id].is_alive():
                 time.sleep(0.1)
             del self.deviceDict[dev.id]
+            self.flushWrites(dev.id)
+            self.dependents = None
+            self.predicates = None
+            self.refreshAggregates(dev)
+
+    #-------------------------------------------------------------------------------
+    def refreshAggregates(self, dev):
+        """Aggregates reload their members when a running timer starts or stops"""
+        if dev.deviceTypeId == 'runningTimer':
+            for device in self.deviceDict.values():
+                if isinstance(device, RunningAggregate):
+                    device.doTask('reconfigure', device.props)
+
+    #-------------------------------------------------------------------------------
+    def scheduleWindow(self, device, initial=False):
+        """Open or close a timer's active window and queue its next boundary"""
+        isOpen, nextChange = device.window.state(time.time())
+        if isOpen != device.windowOpen:
+            # inputs are checked against this at dispatch, before anything is queued
+            device.windowOpen = isOpen
+            if not initial:
+                device.doTask('window', isOpen)
+        with self.windowLock:
+            heapq.heappush(self.windowQueue, (nextChange, next(self.windowCount), device))
+
+    #-------------------------------------------------------------------------------
+    def getLocation(self):
+        if self.location is None:
+            self.location = indigo.server.getLatitudeAndLongitude()
+        return self.location
+
+    #-------------------------------------------------------------------------------
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        if newDev.id not in self.deviceDict:
+            return True
+        oldProps = origDev.pluginProps
+        newProps = newDev.pluginProps
+        changed = [key for key in set(oldProps.keys()) | set(newProps.keys()) if oldProps.get(key) != newProps.get(key)]
+        if newProps.get('logicType','simple') == 'expression' and changed:
+            # expression inputs are bound when the timer starts
+            return True
+        return any(key in k_coldProps for key in changed)
 
     #-------------------------------------------------------------------------------
     def validateDeviceConfigUi(self, valuesDict, typeId, devId, runtime=False):
@@ -219,11 +470,52 @@ class Plugin(indigo.PluginBase):
                 key = k_variableKeys[0]
             if not valuesDict.get(key,''):
                 errorsDict[key] = "Required"
+            if valuesDict.get('stateProfile','full') == 'custom':
+                for span, name in k_timeSpans.items():
+                    key = f'stateSlots{name}'
+                    if not (valuesDict.get(key,'').isdigit() and int(valuesDict[key]) <= k_periodRange[span]):
+                        errorsDict[key] = f"Must be an integer from 0 to {k_periodRange[span]}"
+            names = set(k_timeSpans.values())
+            for n in range(1, len(k_customSpans)+1):
+                if valuesDict.get(f'customRule{n}','none') == 'none':
+                    continue
+                name = valuesDict.get(f'customName{n}','')
+                if not (name[:1].isupper() and name.isalnum()) or name in names:
+                    errorsDict[f'customName{n}'] = "Must be a unique capitalized name of letters and digits"
+                names.add(name)
+                try:
+                    datetime.strptime(valuesDict.get(f'customAnchor{n}',''), '%Y-%m-%d %H:%M')
+                except ValueError:
+                    errorsDict[f'customAnchor{n}'] = "Must be a date and time, e.g. 2024-01-15 00:00"
+                if not (valuesDict.get(f'customPeriod{n}','').isdigit() and int(valuesDict[f'customPeriod{n}']) > 0):
+                    errorsDict[f'customPeriod{n}'] = "Must be an integer greater than zero"
+                if not (valuesDict.get(f'customSlots{n}','').isdigit() and 0 < int(valuesDict[f'customSlots{n}']) <= k_customRange):
+                    errorsDict[f'customSlots{n}'] = f"Must be an integer from 1 to {k_customRange}"
+
+        elif typeId == 'runningAggregate':
+            requiredIntegers = []
+            if not list(valuesDict.get('members',[])):
+                errorsDict['members'] = "Select at least one timer"
+
+        elif typeId == 'sequenceTimer':
+            requiredIntegers = ['offCycles']
+            for i, (devKey, stateKey) in enumerate(k_deviceKeys[:k_sequenceSteps]):
+                if i < 2 and not zint(valuesDict.get(devKey,'')):
+                    errorsDict[devKey] = "Required"
+                if i and zint(valuesDict.get(devKey,'')):
+                    requiredIntegers.append(f'stepCycles{i+1}')
 
         for key in requiredIntegers:
             if not valuesDict.get(key,"").isdigit():
                 errorsDict[key] = "Must be an integer zero or greater"
 
+        if valuesDict.get('ingestPolicy','none') in ['interval','debounce']:
+            try:
+                if float(valuesDict.get('ingestSeconds','')) <= 0:
+                    errorsDict['ingestSeconds'] = "Must be a number greater than zero"
+            except ValueError:
+                errorsDict['ingestSeconds'] = "Must be a number greater than zero"
+
         for devKey, stateKey in k_deviceKeys:
             if zint(valuesDict.get(devKey,'')) and not valuesDict.get(stateKey,''):
                 errorsDict[stateKey] = "Required"
@@ -234,21 +526,87 @@ class Plugin(indigo.PluginBase):
                     temp = float(valuesDict.get('value',''))
                 except:
                     errorsDict['value'] = "Make value a number or change data type"
+                if valuesDict.get('offValue','').strip():
+                    try:
+                        offTemp = float(valuesDict['offValue'])
+                        if 'value' not in errorsDict:
+                            if valuesDict.get('operator','eq') in ['gt','ge'] and offTemp > temp:
+                                errorsDict['offValue'] = "Must not be greater than comparison value"
+                            elif valuesDict.get('operator','eq') in ['lt','le'] and offTemp < temp:
+                                errorsDict['offValue'] = "Must not be less than comparison value"
+                    except ValueError:
+                        errorsDict['offValue'] = "Make value a number or leave blank"
+                if valuesDict.get('deadband','').strip():
+                    try:
+                        if float(valuesDict['deadband']) < 0:
+                            errorsDict['deadband'] = "Must be zero or greater"
+                    except ValueError:
+                        errorsDict['deadband'] = "Make value a number or leave blank"
+            elif valuesDict.get('offValue','').strip() or valuesDict.get('deadband','').strip():
+                errorsDict['valueType'] = "Off value and deadband require number data type"
+
+        elif valuesDict.get('logicType','simple') == 'expression':
+            if typeId == 'sequenceTimer':
+                # steps each compare their own input, see SequenceTimer.devChanged
+                errorsDict['logicType'] = "Sequence timers don't support expression logic"
+            else:
+                try:
+                    temp = Expression(valuesDict.get('expression',''), valuesDict)
+                except ValueError as e:
+                    errorsDict['expression'] = str(e)
+
+        if valuesDict.get('windowEnabled',False):
+            for edge in ['Start','End']:
+                if valuesDict.get(f'window{edge}Type','time') == 'time':
+                    try:
+                        datetime.strptime(valuesDict.get(f'window{edge}Time',''), '%H:%M')
+                    except ValueError:
+                        errorsDict[f'window{edge}Time'] = "Must be a 24 hour time, e.g. 21:30"
+                elif not valuesDict.get(f'window{edge}Offset','').lstrip('-').isdigit():
+                    errorsDict[f'window{edge}Offset'] = "Must be a whole number of minutes"
 
         if len(errorsDict) > 0:
             self.logger.debug(f'validate device config error: \n{errorsDict}')
             return (False, valuesDict, errorsDict)
         else:
-            # on success, reset generated device and variable lists
-            self.configDeviceList = list()
-            self.configVariableList = list()
             return (True, valuesDict)
 
+    #-------------------------------------------------------------------------------
+    def getDeviceStateList(self, dev):
+        stateList = indigo.PluginBase.getDeviceStateList(self, dev)
+        if dev.deviceTypeId == 'runningTimer':
+            spanSlots, strings, legacy = state_profile(dev.pluginProps)
+            customSpans = custom_spans(dev.pluginProps)
+            spanSlots += tuple((span, custom.slots) for span, custom in customSpans.items())
+            for span, slots in spanSlots:
+                name = customSpans[span].name if span in customSpans else k_timeSpans[span]
+                for i in range(slots):
+                    label = span_label(span, i, name=name)
+                    stateList.append(self.getDeviceStateDictForNumberType(f'seconds{name}{i:02}', f'Seconds On {label}', f'Seconds On {label}'))
+                if strings:
+                    for i in range(slots):
+                        label = span_label(span, i, name=name)
+                        stateList.append(self.getDeviceStateDictForStringType(f'string{name}{i:02}', f'String On {label}', f'String On {label}'))
+                if legacy and span in k_timeSpans:
+                    for prefix, label in (('This', span_label(span, 0, True)), ('Last', span_label(span, 1, True))):
+                        stateList.append(self.getDeviceStateDictForNumberType(f'seconds{prefix}{name}', f'DEPRICATED: Seconds On {label}', f'DEPRICATED: Seconds On {label}'))
+                        stateList.append(self.getDeviceStateDictForStringType(f'string{prefix}{name}', f'DEPRICATED: String On {label}', f'DEPRICATED: String On {label}'))
+        if dev.deviceTypeId == 'runningTimer' and dev.pluginProps.get('cycleStats',False):
+            for span in k_cycleSpans:
+                name = k_timeSpans[span]
+                stateList.append(self.getDeviceStateDictForNumberType(f'cycleCount{name}', f'Cycles This {name}', f'Cycles This {name}'))
+                stateList.append(self.getDeviceStateDictForNumberType(f'cycleMin{name}', f'Shortest Cycle This {name}', f'Shortest Cycle This {name}'))
+                stateList.append(self.getDeviceStateDictForNumberType(f'cycleMax{name}', f'Longest Cycle This {name}', f'Longest Cycle This {name}'))
+                stateList.append(self.getDeviceStateDictForNumberType(f'cycleMean{name}', f'Mean Cycle This {name}', f'Mean Cycle This {name}'))
+                stateList.append(self.getDeviceStateDictForNumberType(f'dutyCycle{name}', f'Duty Cycle This {name}', f'Duty Cycle This {name}'))
+        return stateList
+
     #-------------------------------------------------------------------------------
     def updateDeviceVersion(self, dev):
         theProps = dev.pluginProps
-        # update states
+        # update states, e.g. the distinct count states activity timers gained in 0.1.1
         dev.stateListOrDisplayStateIdChanged()
+        dev.refreshFromServer()
 
         # update logic selections
         if ver(theProps.get('version',"0.0.0")) < ver("0.0.9"):
@@ -275,7 +633,22 @@ class Plugin(indigo.PluginBase):
         dev.replacePluginPropsOnServer(theProps)
 
     #-------------------------------------------------------------------------------
+    def deviceCreated(self, dev):
+        indigo.PluginBase.deviceCreated(self, dev)
+        self.deviceIndex.add(dev)
+
+    #-------------------------------------------------------------------------------
+    def deviceDeleted(self, dev):
+        indigo.PluginBase.deviceDeleted(self, dev)
+        self.deviceIndex.remove(dev.id)
+
+    #-------------------------------------------------------------------------------
+    @profiled
     def deviceUpdated(self, oldDev, newDev):
+        self.deviceIndex.update(newDev)
+        capture = self.capture
+        if capture:
+            self.captureInput(capture, oldDev, newDev)
 
         if newDev.pluginId == self.pluginId:
             # device belongs to plugin
@@ -283,17 +656,219 @@ class Plugin(indigo.PluginBase):
             if (newDev.id in self.deviceDict) and (newDev.name != oldDev.name):
                 # I hate it when the log continues to use an old name
                 self.deviceDict[newDev.id].name = newDev.name
+            if (newDev.id in self.deviceDict) and (newDev.folderId != oldDev.folderId):
+                self.deviceDict[newDev.id].folderId = newDev.folderId
+            if (newDev.id in self.deviceDict) and (newDev.pluginProps != oldDev.pluginProps) \
+                    and not self.didDeviceCommPropertyChange(oldDev, newDev):
+                # settings changed without a restart, see didDeviceCommPropertyChange
+                self.deviceDict[newDev.id].doTask('reconfigure', newDev.pluginProps)
 
         # plugin devices may belong to other plugin devices
+        skipIds = ()
+        if newDev.pluginId == self.pluginId:
+            # timer changes already reached these timers in-process
+            skipIds = self.getDependents(newDev.id)[1]
+        predicates, sharedIds = self.getPredicates(newDev.id)
+        self.dispatchPredicates(predicates, oldDev, newDev)
         for device in self.deviceDict.values():
-            device.doTask('devChanged', oldDev, newDev)
+            if device.id not in skipIds and device.id not in sharedIds:
+                device.ingest('devChanged', oldDev, newDev)
+
+    #-------------------------------------------------------------------------------
+    def getDependents(self, devId):
+        maps = self.dependents
+        if maps is None:
+            maps = self.buildDependents()
+        dependents, dependentIds = maps
+        return dependents.get(devId, ()), dependentIds.get(devId, ())
+
+    #-------------------------------------------------------------------------------
+    def buildDependents(self):
+        """Map each timer to the timers that track it, in topological order"""
+        timers = dict(self.deviceDict)
+        upstream = {devId:[srcId for srcId in device.deviceStateDict if srcId in timers] for devId, device in timers.items()}
+
+        # Kahn's algorithm, anything left over is part of a cycle
+        remaining = {devId:len(srcIds) for devId, srcIds in upstream.items()}
+        downstream = dict()
+        for devId, srcIds in upstream.items():
+            for srcId in srcIds:
+                downstream.setdefault(srcId, []).append(devId)
+        ready = [devId for devId, count in remaining.items() if not count]
+        order = dict()
+        while ready:
+            devId = ready.pop()
+            order[devId] = len(order)
+            for dstId in downstream.get(devId, []):
+                remaining[dstId] -= 1
+                if not remaining[dstId]:
+                    ready.append(dstId)
+
+        dependents = dict()
+        for devId in order:
+            dstIds = sorted((dstId for dstId in downstream.get(devId, []) if dstId in order), key=order.get)
+            if dstIds:
+                dependents[devId] = [timers[dstId] for dstId in dstIds]
+        for devId in timers:
+            if devId not in order:
+                self.logger.warning(f'"{timers[devId].name}" is part of or follows a timer cycle, changes will only arrive via the server')
+
+        dependentIds = {devId:frozenset(device.id for device in devices) for devId, devices in dependents.items()}
+        self.dependents = (dependents, dependentIds)
+        return self.dependents
+
+    #-------------------------------------------------------------------------------
+    def getPredicates(self, inputId):
+        maps = self.predicates
+        if maps is None:
+            maps = self.buildPredicates()
+        predicates, sharedIds, watched = maps
+        return predicates.get(inputId, ()), sharedIds
+
+    #-------------------------------------------------------------------------------
+    def buildPredicates(self):
+        """Intern identical input and comparison pairs so each is evaluated once per change"""
+        interned = dict()
+        sharedIds = set()
+        watched = dict()
+        for device in list(self.deviceDict.values()):
+            for devId, stateKeys in device.deviceStateDict.items():
+                watched[devId] = watched.get(devId, ()) + tuple(key for key in stateKeys if key not in watched.get(devId, ()))
+            for varId in device.variableList:
+                watched[varId] = None
+            # timers tracking other timers get changes through propagate instead
+            if not device.sharesPredicates() or any(devId in self.deviceDict for devId in device.deviceStateDict):
+                continue
+            comparison = device.comparisonKey()
+            inputs = [(devId, stateKey) for devId, stateKeys in device.deviceStateDict.items() for stateKey in stateKeys]
+            inputs += [(varId, None) for varId in device.variableList]
+            for inputId, stateKey in inputs:
+                key = (inputId, stateKey) + comparison
+                predicate = interned.get(key)
+                if predicate is None:
+                    # carry hysteresis memory over from the last build of the same comparison
+                    prior = self.interned.get(key)
+                    predicate = interned[key] = InputPredicate(inputId, stateKey, device, prior.memory if prior else None)
+                predicate.subscribers.append(device)
+            sharedIds.add(device.id)
+
+        predicates = dict()
+        for predicate in interned.values():
+            predicates.setdefault(predicate.inputId, []).append(predicate)
+        self.logger.debug(f'{len(interned)} shared predicates for {len(sharedIds)} timers')
+        self.interned   = interned
+        self.predicates = (predicates, frozenset(sharedIds), watched)
+        return self.predicates
+
+    #-------------------------------------------------------------------------------
+    def captureInput(self, capture, old, new):
+        """Record what a device or variable update delivered to the timers watching it"""
+        maps = self.predicates
+        if maps is None:
+            maps = self.buildPredicates()
+        watched = maps[2]
+        if new.id in watched:
+            stateKeys = watched[new.id]
+            if stateKeys is None:
+                capture.add(1, new.id, (('', old.value, new.value),))
+            else:
+                capture.add(0, new.id, tuple((key, old.states.get(key), new.states.get(key)) for key in stateKeys))
+
+    #-------------------------------------------------------------------------------
+    def dispatchPredicates(self, predicates, old, new):
+        """Evaluate each shared predicate once and queue one task per subscriber with all its edges"""
+        edges = dict()
+        for predicate in predicates:
+            try:
+                result = predicate.evaluate(old, new)
+            except Exception as e:
+                self.logger.error(f'"{predicate.owner.name}" input "{new.name}" error \n{e}')
+                continue
+            if result is not None:
+                for device in predicate.subscribers:
+                    if device.windowOpen:
+                        edges.setdefault(device, []).append(result)
+        for device, results in edges.items():
+            device.doTask('edge', results, new)
+
+    #-------------------------------------------------------------------------------
+    def propagate(self, devId, oldDev, newDev):
+        """Hand a timer's state change straight to the timers that track it"""
+        for device in self.getDependents(devId)[0]:
+            device.ingest('devChanged', oldDev, newDev)
+
+    #-------------------------------------------------------------------------------
+    def queueWrite(self, dev, newStates, image=None):
+        """Hold a timer's state changes for the next tick, later values for a key replace earlier ones"""
+        with self.writeLock:
+            pending = self.pendingWrites.setdefault(dev.id, [dev, dict(), None])
+            pending[1].update((item['key'], item['value']) for item in newStates)
+            if image is not None:
+                pending[2] = image
+
+    #-------------------------------------------------------------------------------
+    def flushWrites(self, devId=None):
+        """Send held state changes to the server, one call per timer"""
+        with self.writeLock:
+            if devId is None:
+                writes, self.pendingWrites = self.pendingWrites, dict()
+            else:
+                writes = {devId:self.pendingWrites.pop(devId)} if devId in self.pendingWrites else dict()
+        for dev, states, image in writes.values():
+            try:
+                if image is not None:
+                    dev.updateStateImageOnServer(k_stateImages[image])
+                dev.updateStatesOnServer([{'key':key,'value':value} for key, value in states.items()])
+            except Exception as e:
+                self.logger.error(f'"{dev.name}" state write error \n{e}')
 
     #-------------------------------------------------------------------------------
     # Variable Methods
     #-------------------------------------------------------------------------------
+    def variableCreated(self, var):
+        indigo.PluginBase.variableCreated(self, var)
+        self.variableIndex.add(var)
+
+    #-------------------------------------------------------------------------------
+    def variableDeleted(self, var):
+        indigo.PluginBase.variableDeleted(self, var)
+        self.variableIndex.remove(var.id)
+
+    #-------------------------------------------------------------------------------
+    @profiled
     def variableUpdated(self, oldVar, newVar):
+        self.variableIndex.update(newVar)
+        capture = self.capture
+        if capture:
+            self.captureInput(capture, oldVar, newVar)
+        predicates, sharedIds = self.getPredicates(newVar.id)
+        self.dispatchPredicates(predicates, oldVar, newVar)
         for devId, device in self.deviceDict.items():
-            device.doTask('varChanged', oldVar, newVar)
+            if devId not in sharedIds:
+                device.ingest('varChanged', oldVar, newVar)
+
+    #-------------------------------------------------------------------------------
+    # Trigger Methods
+    #-------------------------------------------------------------------------------
+    def triggerStartProcessing(self, trigger):
+        key = (trigger.pluginTypeId, zint(trigger.pluginProps.get('timerDevice','')))
+        self.triggerDict[key] = self.triggerDict.get(key, ()) + (trigger,)
+
+    #-------------------------------------------------------------------------------
+    def triggerStopProcessing(self, trigger):
+        key = (trigger.pluginTypeId, zint(trigger.pluginProps.get('timerDevice','')))
+        triggers = tuple(item for item in self.triggerDict.get(key, ()) if item.id != trigger.id)
+        if triggers:
+            self.triggerDict[key] = triggers
+        else:
+            self.triggerDict.pop(key, None)
+
+    #-------------------------------------------------------------------------------
+    def fireEvent(self, eventId, devId, span=None):
+        for trigger in self.triggerDict.get((eventId, devId), ()) + self.triggerDict.get((eventId, 0), ()):
+            if span and trigger.pluginProps.get('span','any') not in ['any', span]:
+                continue
+            indigo.trigger.execute(trigger)
 
     #-------------------------------------------------------------------------------
     # Action Methods
@@ -311,6 +886,50 @@ class Plugin(indigo.PluginBase):
         else:
             self.logger.error(f'device id "{action.deviceId}" not available')
 
+    #-------------------------------------------------------------------------------
+    def groupForceOn(self, action):
+        self.doGroupTask(action, 'turnOn')
+
+    #-------------------------------------------------------------------------------
+    def groupForceOff(self, action):
+        self.doGroupTask(action, 'turnOff')
+
+    #-------------------------------------------------------------------------------
+    def doGroupTask(self, action, task):
+        # every timer in the group acts as of the same moment
+        taskTime = time.time()
+        devices = self.getGroupTimers(action.props)
+        for device in devices:
+            device.doTask(task, taskTime)
+        self.logger.debug(f'{action.pluginTypeId}: {len(devices)} timers')
+
+    #-------------------------------------------------------------------------------
+    def getGroupTimers(self, props):
+        groupMode = props.get('groupMode','folder')
+        if groupMode == 'folder':
+            folderId = zint(props.get('folder',''))
+            return [device for device in self.deviceDict.values() if device.folderId == folderId]
+        elif groupMode == 'type':
+            timerType = props.get('timerType','all')
+            return [device for device in self.deviceDict.values() if timerType in ['all', device.dev.deviceTypeId]]
+        else:
+            timerIds = set(zint(timerId) for timerId in props.get('timerList',[]))
+            return [device for device in self.deviceDict.values() if (0 in timerIds) or (device.id in timerIds)]
+
+    #-------------------------------------------------------------------------------
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        errorsDict = indigo.Dict()
+        if typeId in ['groupForceOn','groupForceOff']:
+            if valuesDict.get('groupMode','folder') == 'folder' and not valuesDict.get('folder',''):
+                errorsDict['folder'] = "Required"
+            elif valuesDict.get('groupMode','folder') == 'list' and not list(valuesDict.get('timerList',[])):
+                errorsDict['timerList'] = "Select at least one timer"
+
+        if len(errorsDict) > 0:
+            self.logger.debug(f'validate action config error: \n{errorsDict}')
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
     #-------------------------------------------------------------------------------
     # Menu Methods
     #-------------------------------------------------------------------------------
@@ -331,44 +950,402 @@ class Plugin(indigo.PluginBase):
             self.debug = True
             self.logger.debug('Debug logging enabled')
 
+    #-------------------------------------------------------------------------------
+    def logIngestStats(self):
+        for device in self.deviceDict.values():
+            for inputId, (passed, dropped) in list(device.ingestStats.items()):
+                if inputId in indigo.devices:
+                    inputName = indigo.devices[inputId].name
+                elif inputId in indigo.variables:
+                    inputName = indigo.variables[inputId].name
+                else:
+                    inputName = inputId
+                self.logger.info(f'"{device.name}" input "{inputName}" [policy:{device.ingestPolicy}, passed:{passed}, dropped:{dropped}]')
+
+    #-------------------------------------------------------------------------------
+    def dumpTrace(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        devId = zint(valuesDict.get('traceTimer',''))
+        if devId not in self.deviceDict:
+            errorsDict['traceTimer'] = "Select a timer that is running"
+            return (False, valuesDict, errorsDict)
+        device = self.deviceDict[devId]
+        records = list(device.traceBuffer)
+        self.logger.info(f'"{device.name}" trace: {len(records)} records')
+        for t, msg, args in records:
+            self.logger.info(f'{format_datetime(t)} {msg % args}')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def startProfile(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        path = os.path.expanduser(valuesDict.get('profileFile','').strip())
+        if self.profiler:
+            errorsDict['profileSeconds'] = "A profile is already being collected"
+        if not valuesDict.get('profileSeconds','').isdigit() or not int(valuesDict['profileSeconds']):
+            errorsDict['profileSeconds'] = "Must be an integer greater than zero"
+        if not path:
+            errorsDict['profileFile'] = "Required"
+        elif not os.path.isdir(os.path.dirname(path) or '.'):
+            errorsDict['profileFile'] = "Folder does not exist"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        self.profiler = ProfileWindow(int(valuesDict['profileSeconds']), path)
+        self.logger.info(f'profiling for {valuesDict["profileSeconds"]} seconds')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def finishProfile(self):
+        profiler, self.profiler = self.profiler, None
+        stats = profiler.stats()
+        if stats is None:
+            self.logger.info('profiling finished, nothing was collected')
+            return
+        stats.dump_stats(profiler.path)
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats('cumulative').print_stats(k_profileLines)
+        self.logger.info(f'profile saved to "{profiler.path}"')
+        for line in report.getvalue().splitlines():
+            if line.strip():
+                self.logger.info(line)
+
+    #-------------------------------------------------------------------------------
+    def startCapture(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        path = os.path.expanduser(valuesDict.get('captureFile','').strip())
+        if self.capture:
+            errorsDict['captureFile'] = "Events are already being captured"
+        elif not path:
+            errorsDict['captureFile'] = "Required"
+        elif not os.path.isdir(os.path.dirname(path) or '.'):
+            errorsDict['captureFile'] = "Folder does not exist"
+        for key in ['captureMegabytes','captureFiles']:
+            if not valuesDict.get(key,'').isdigit() or not int(valuesDict[key]):
+                errorsDict[key] = "Must be an integer greater than zero"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        try:
+            self.capture = EventCapture(path, int(valuesDict['captureMegabytes']) << 20, int(valuesDict['captureFiles']))
+        except OSError as e:
+            errorsDict['captureFile'] = str(e)
+            return (False, valuesDict, errorsDict)
+        self.logger.info(f'capturing timer input events to "{path}"')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def stopCapture(self):
+        if not self.capture:
+            self.logger.info('no events are being captured')
+            return
+        capture, self.capture = self.capture, None
+        capture.close()
+        perEvent = 1e6*capture.seconds/capture.records if capture.records else 0.0
+        self.logger.info(f'event capture stopped [records:{capture.records}, dropped:{capture.dropped}, bytes:{capture.bytes}, microseconds per update:{perEvent:.1f}]')
+
+    #-------------------------------------------------------------------------------
+    def inspectCapture(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        path = os.path.expanduser(valuesDict.get('captureFile','').strip())
+        if not path:
+            errorsDict['captureFile'] = "Required"
+        elif not os.path.isfile(path):
+            errorsDict['captureFile'] = "File does not exist"
+        if not valuesDict.get('captureRecords','').isdigit():
+            errorsDict['captureRecords'] = "Must be an integer"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        counts = dict()
+        recent = deque(maxlen=int(valuesDict['captureRecords']))
+        first = last = None
+        try:
+            for record in read_capture_file(path):
+                t, kind, inputId, key = record[:4]
+                first = t if first is None else first
+                last = t
+                counts[(kind, inputId, key)] = counts.get((kind, inputId, key), 0) + 1
+                recent.append(record)
+        except (OSError, ValueError) as e:
+            errorsDict['captureFile'] = str(e)
+            return (False, valuesDict, errorsDict)
+        if first is None:
+            self.logger.info(f'"{path}" holds no captured events')
+            return True
+        self.logger.info(f'"{path}" holds {sum(counts.values())} events from {datetime.fromtimestamp(first)} to {datetime.fromtimestamp(last)}')
+        for (kind, inputId, key), count in sorted(counts.items(), key=lambda item: -item[1]):
+            self.logger.info(f'    {capture_input_name(kind, inputId, key)} [updates:{count}]')
+        for t, kind, inputId, key, old, new in recent:
+            self.logger.info(f'    {datetime.fromtimestamp(t)} {capture_input_name(kind, inputId, key)}: {old} -> {new}')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def shadowTimers(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        shadowMode = valuesDict.get('shadowMode','attach')
+        devId = zint(valuesDict.get('shadowTimer',''))
+        if devId and devId not in self.deviceDict:
+            errorsDict['shadowTimer'] = "Select a timer that is running"
+        elif not devId and shadowMode != 'report':
+            errorsDict['shadowTimer'] = "Select a timer"
+        elif shadowMode == 'attach':
+            live = self.deviceDict[devId]
+            try:
+                overrides = parse_overrides(valuesDict.get('shadowProps',''))
+            except ValueError as e:
+                overrides = dict()
+                errorsDict['shadowProps'] = str(e)
+            fixed = [key for key in overrides if key in k_shadowFixedProps]
+            if isinstance(live, RunningAggregate):
+                errorsDict['shadowTimer'] = "Running aggregates can't be shadowed"
+            elif not overrides and 'shadowProps' not in errorsDict:
+                errorsDict['shadowProps'] = "Enter at least one setting, e.g. offCycles=5"
+            elif fixed:
+                errorsDict['shadowProps'] = f"Inputs and filtering are shared with the timer: {', '.join(fixed)}"
+            elif 'expression' in [live.logic, overrides.get('logicType')]:
+                errorsDict['shadowProps'] = "Expression logic can't be shadowed"
+            else:
+                props = shadow_props(live.props, overrides)
+                result = self.validateDeviceConfigUi(props, live.dev.deviceTypeId, devId)
+                if not result[0]:
+                    errorsDict['shadowProps'] = '; '.join(f'{key}: {error}' for key, error in result[2].items())
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+
+        if shadowMode == 'attach':
+            live.shadowCount += 1
+            shadowDev = ShadowDevice(live.dev, live.states, props, overrides, live.shadowCount)
+            live.doTask('attach', type(live)(shadowDev, self))
+            self.logger.info(f'"{shadowDev.name}" attached [{format_overrides(overrides)}]')
+        elif shadowMode == 'detach':
+            self.deviceDict[devId].doTask('detach')
+            self.logger.info(f'"{self.deviceDict[devId].name}" shadows detached')
+        else:
+            now = time.time()
+            for live in [self.deviceDict[devId]] if devId else list(self.deviceDict.values()):
+                for shadow in list(live.shadows):
+                    dev = shadow.dev
+                    diverged = dev.divergedSeconds + (now - dev.since if dev.since is not None else 0)
+                    self.logger.info(f'"{dev.name}" [{format_overrides(dev.overrides)}] [onOff:{shadow.onState}, live:{live.onState}, divergences:{dev.divergences}, diverged:{format_seconds(diverged)}]')
+                    for t, liveOn, shadowOn in list(dev.timeline):
+                        self.logger.info(f'{format_datetime(t)} [live:{["off","on"][liveOn]}, shadow:{["off","on"][shadowOn]}]')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def logMemoryUse(self, action=None):
+        """Bytes per timer of each type, estimated from the running timers and measured by building copies"""
+        shared = {id(self), id(self.logger)}
+        usage = dict()
+        samples = dict()
+        for device in list(self.deviceDict.values()):
+            # the device object belongs to indigo and would be held anyway
+            total, count = usage.get(device.dev.deviceTypeId, (0, 0))
+            usage[device.dev.deviceTypeId] = (total + approx_size(device, shared | {id(device.dev)}), count + 1)
+            if not isinstance(device, RunningAggregate):
+                samples.setdefault(device.dev.deviceTypeId, device)
+
+        # throwaway copies on stand-in devices are never started and never write to the server
+        measured = dict()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            threads = [threading.Thread() for i in range(k_memorySamples)]
+            threadBytes = (tracemalloc.get_traced_memory()[0] - start) // k_memorySamples
+            del threads
+            for typeId, live in samples.items():
+                devs = [ShadowDevice(live.dev, live.states, live.props, dict(), 0) for i in range(k_memorySamples)]
+                start = tracemalloc.get_traced_memory()[0]
+                copies = [type(live)(dev, self) for dev in devs]
+                measured[typeId] = (tracemalloc.get_traced_memory()[0] - start) // k_memorySamples
+                del copies, devs
+        finally:
+            tracemalloc.stop()
+
+        self.logger.info(f'memory use [threading.Thread:{threadBytes} bytes each]')
+        for typeId, (total, count) in sorted(usage.items()):
+            if typeId in measured:
+                self.logger.info(f'{typeId} [timers:{count}, bytes per timer:{total//count}, measured:{measured[typeId]}]')
+            else:
+                self.logger.info(f'{typeId} [timers:{count}, bytes per timer:{total//count}]')
+
+    #-------------------------------------------------------------------------------
+    def reportArchive(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        reportType = valuesDict.get('reportType','weekday')
+        for key in ['reportCount','reportDays']:
+            if reportType == 'top' and not (valuesDict.get(key,'').isdigit() and int(valuesDict[key])):
+                errorsDict[key] = "Must be an integer greater than zero"
+        timerIds = set(zint(timerId) for timerId in valuesDict.get('reportTimers',[]))
+        if not timerIds:
+            errorsDict['reportTimers'] = "Select at least one timer"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+
+        # every archived timer, including any that have since been deleted
+        try:
+            archiveIds = [zint(name) for name in os.listdir(self.archiveFolder) if zint(name)]
+        except OSError:
+            archiveIds = list()
+        archiveIds = sorted(devId for devId in archiveIds if (0 in timerIds) or (devId in timerIds))
+        names = {devId:(indigo.devices[devId].name if devId in indigo.devices else str(devId)) for devId in archiveIds}
+        self.logger.info(f'span archive report: {len(archiveIds)} timers in "{self.archiveFolder}"')
+
+        if reportType == 'weekday':
+            for devId in archiveIds:
+                means = weekday_means(*read_span_archive(self.archiveFolder, devId, k_timeSpans['d']))
+                self.logger.info(f'"{names[devId]}" mean per day [' + ', '.join(f'{day}:{format_seconds(mean)}' for day, mean in zip(k_weekdays, means)) + ']')
+        elif reportType == 'yearly':
+            for devId in archiveIds:
+                totals = month_totals(*read_span_archive(self.archiveFolder, devId, k_timeSpans['m']))
+                for (year, month), seconds in sorted(totals.items()):
+                    prior = totals.get((year-1, month))
+                    change = f', change:{100*(seconds-prior)/prior:+.1f}%' if prior else ''
+                    self.logger.info(f'"{names[devId]}" {year}-{month:02} [total:{format_seconds(seconds)}{change}]')
+        else:
+            since = time.time() - int(valuesDict['reportDays'])*24*60*60
+            totals = [(span_total(*read_span_archive(self.archiveFolder, devId, k_timeSpans['d']), since), devId) for devId in archiveIds]
+            for seconds, devId in sorted(totals, reverse=True)[:int(valuesDict['reportCount'])]:
+                self.logger.info(f'"{names[devId]}" [total:{format_seconds(seconds)}]')
+        return True
+
+    #-------------------------------------------------------------------------------
+    def provisionTimers(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        path = os.path.expanduser(valuesDict.get('provisionFile','').strip())
+        if not path:
+            errorsDict['provisionFile'] = "Required"
+        elif os.path.splitext(path)[1].lower() not in ['.json','.csv']:
+            errorsDict['provisionFile'] = "Must be a .json or .csv file"
+        else:
+            try:
+                if valuesDict.get('provisionMode','import') == 'export':
+                    self.exportTimers(path)
+                else:
+                    self.importTimers(path)
+            except (IOError, ValueError) as e:
+                errorsDict['provisionFile'] = str(e)
+
+        if len(errorsDict) > 0:
+            self.logger.debug(f'provision timers error: \n{errorsDict}')
+            return (False, valuesDict, errorsDict)
+        return True
+
+    #-------------------------------------------------------------------------------
+    def importTimers(self, path):
+        entries = read_timer_file(path)
+        existing = {dev.name:dev for dev in indigo.devices.iter('self')}
+
+        # validate everything before changing anything
+        problems = list()
+        for line, entry in enumerate(entries, 1):
+            if not entry['name']:
+                problems.append(f'entry {line}: name required')
+            elif entry['type'] not in k_timerTypes:
+                problems.append(f'"{entry["name"]}": unknown type "{entry["type"]}"')
+            elif entry['name'] in existing and existing[entry['name']].deviceTypeId != entry['type']:
+                problems.append(f'"{entry["name"]}": existing device is a {existing[entry["name"]].deviceTypeId}')
+            else:
+                # entries for existing timers may list only the settings they change
+                props = dict(existing[entry['name']].pluginProps) if entry['name'] in existing else dict()
+                props.update(entry['props'])
+                result = self.validateDeviceConfigUi(props, entry['type'], existing[entry['name']].id if entry['name'] in existing else 0)
+                if not result[0]:
+                    problems.extend(f'"{entry["name"]}": {key} {error.lower()}' for key, error in result[2].items())
+        if problems:
+            for problem in problems:
+                self.logger.error(f'import: {problem}')
+            raise ValueError("Validation failed, see log for details")
+
+        folders = {folder.name:folder.id for folder in indigo.devices.folders}
+        created = updated = 0
+        createdIds = list()
+        try:
+            for entry in entries:
+                folderId = 0
+                if entry['folder']:
+                    if entry['folder'] not in folders:
+                        folders[entry['folder']] = indigo.devices.folder.create(entry['folder']).id
+                    folderId = folders[entry['folder']]
+                if entry['name'] in existing:
+                    dev = existing[entry['name']]
+                    theProps = dev.pluginProps
+                    theProps.update(entry['props'])
+                    dev.replacePluginPropsOnServer(theProps)
+                    if folderId and dev.folderId != folderId:
+                        indigo.device.moveToFolder(dev, value=folderId)
+                    updated += 1
+                else:
+                    dev = indigo.device.create(indigo.kProtocol.Plugin, name=entry['name'], deviceTypeId=entry['type'],
+                                               props=entry['props'], folder=folderId)
+                    createdIds.append(dev.id)
+                    created += 1
+        finally:
+            # start the new timers together, rather than waiting on the server to start each one
+            for devId in createdIds:
+                if devId in indigo.devices:
+                    self.deviceStartComm(indigo.devices[devId])
+        self.logger.info(f'imported {len(entries)} timers from "{path}" [created:{created}, updated:{updated}]')
+
+    #-------------------------------------------------------------------------------
+    def exportTimers(self, path):
+        folderNames = {folder.id:folder.name for folder in indigo.devices.folders}
+        entries = list()
+        for dev in indigo.devices.iter('self'):
+            props = {key:value for key, value in dev.pluginProps.items() if key != 'version'}
+            entries.append({'name':dev.name, 'type':dev.deviceTypeId, 'folder':folderNames.get(dev.folderId,''), 'props':props})
+        write_timer_file(path, entries)
+        self.logger.info(f'exported {len(entries)} timers to "{path}"')
+
     #-------------------------------------------------------------------------------
     # Callbacks
     #-------------------------------------------------------------------------------
     def getDeviceList(self, filter='', valuesDict=dict(), typeId='', targetId=0):
         if self.verbose:
             self.logger.debug(f'getDeviceList: {targetId}')
+        # keep current selections listed even when the search hides them
+        keepIds = {zint(valuesDict.get(devKey,'')) for devKey, stateKey in k_deviceKeys}
+        deviceList = self.deviceIndex.items(valuesDict.get('listSearch',''), targetId, keepIds)
+        deviceList.append((0,"- none -"))
+        return deviceList
 
-        if not self.configDeviceList:
-            # generate device list once
-            for dev in indigo.devices.iter():
-                if not dev.id == targetId:
-                    self.configDeviceList.append((dev.id, dev.name))
-            self.configDeviceList.append((0,"- none -"))
+    #-------------------------------------------------------------------------------
+    def getFolderList(self, filter='', valuesDict=dict(), typeId='', targetId=0):
+        folderList = [(folder.id, folder.name) for folder in indigo.devices.folders]
+        folderList.append((0, "- no folder -"))
+        return folderList
 
-        return self.configDeviceList
+    #-------------------------------------------------------------------------------
+    def getTimerList(self, filter='', valuesDict=dict(), typeId='', targetId=0):
+        timerList = [(0, "- any timer -")]
+        for typeId in (filter or '').split(','):
+            iterFilter = f'self.{typeId.strip()}' if typeId.strip() else 'self'
+            timerList.extend((dev.id, dev.name) for dev in indigo.devices.iter(iterFilter))
+        return timerList
 
     #-------------------------------------------------------------------------------
     def getStateList(self, filter=None, valuesDict=dict(), typeId='', targetId=0):
         if self.verbose:
             self.logger.debug(f'getStateList: {targetId}')
-        stateList = list()
         devId = zint(valuesDict.get(filter,''))
-        if devId:
-            for state in indigo.devices[devId].states:
-                stateList.append((state,state))
-        return stateList
+        return [(state,state) for state in self.deviceIndex.stateKeys(devId)]
+
+    #-------------------------------------------------------------------------------
+    def getSpanList(self, filter=None, valuesDict=dict(), typeId='', targetId=0):
+        spanList = [('any', "Any")] + [(span, name) for span, name in k_timeSpans.items() if span != 'c']
+        devId = zint(valuesDict.get(filter,''))
+        if devId in indigo.devices:
+            spanList.extend((span, custom.name) for span, custom in custom_spans(indigo.devices[devId].pluginProps).items())
+        else:
+            spanList.extend((span, f"Custom Span {n}") for n, span in enumerate(k_customSpans, 1))
+        return spanList
 
     #-------------------------------------------------------------------------------
     def getVariableList(self, filter='', valuesDict=dict(), typeId='', targetId=0):
         if self.verbose:
             self.logger.debug(f'getVariableList: {targetId}')
-
-        if not self.configVariableList:
-            # generate variable list once
-            self.configVariableList = [(var.id,var.name) for var in indigo.variables.iter()]
-            self.configVariableList.append((0,"- none -"))
-
-        return self.configVariableList
+        keepIds = {zint(valuesDict.get(varKey,'')) for varKey in k_variableKeys}
+        variableList = self.variableIndex.items(valuesDict.get('listSearch',''), 0, keepIds)
+        variableList.append((0,"- none -"))
+        return variableList
 
     #-------------------------------------------------------------------------------
     def loadStates(self, valuesDict=None, typeId='', targetId=0):
@@ -378,14 +1355,21 @@ class Plugin(indigo.PluginBase):
 # Classes
 ################################################################################
 class TimerBase(threading.Thread):
+    # threading.Thread keeps its own __dict__, the timer's attributes live in slots
+    __slots__ = ('plugin', 'logger', 'dev', 'id', 'folderId', 'props', 'states', 'written',
+                 'stateImg', 'queue', 'cancelled', 'taskTime', 'logic', 'reverse', 'valType',
+                 'operator', 'value', 'offValue', 'deadband', 'logOnOff', 'deviceStateDict', 'variableList',
+                 'inputMemory', 'expression', 'events', 'lastInput', 'traceBuffer', 'shadow',
+                 'shadows', 'shadowCount', 'window', 'windowOpen', 'windowActions', 'ingestPolicy',
+                 'ingestSeconds', 'ingestLock', 'ingestStats', 'ingestLast', 'ingestPending')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(TimerBase, self).__init__()
         self.daemon     = True
         self.cancelled  = False
-        # self.queue      = Queue.Queue()
-        self.queue      = queue.Queue()
+        # nothing joins the queue, so the lighter SimpleQueue will do
+        self.queue      = queue.SimpleQueue()
 
         self.plugin     = plugin
         self.logger     = plugin.logger
@@ -393,31 +1377,142 @@ class TimerBase(threading.Thread):
         self.dev        = instance
         self.id         = instance.id
         self.name       = instance.name
+        self.folderId   = instance.folderId
         self.states     = instance.states
         self.stateImg   = None
+        # states as last queued for a batched write, see update
+        self.written    = None
+
+        # inputMemory: input key -> (last accepted number, last result)
+        self.inputMemory = dict()
+
+        # plugin events to fire once states are saved
+        self.events    = list()
+
+        # (id, name) of the input behind the current tock
+        self.lastInput = (0, '')
+
+        # recent (time, message, args) records, formatted only when dumped or logged
+        self.traceBuffer = deque(maxlen=k_traceSize)
+
+        # shadow timers run every task this timer runs, but only write to a ShadowDevice
+        self.shadow  = isinstance(instance, ShadowDevice)
+        self.shadows = list()
+        # shadows attached so far, numbers them in the log
+        self.shadowCount = 0
+
+        # active window, opened and closed by the plugin's scheduleWindow
+        self.window     = None
+        self.windowOpen = True
+        if instance.pluginProps.get('windowEnabled',False):
+            self.window = TimeWindow(instance.pluginProps, plugin)
+
+        self.configure(instance.pluginProps)
+
+        # input filtering applied by the plugin before anything is queued
+        self.ingestLock    = threading.Lock()
+        # ingestStats: input id -> [passed, dropped]
+        self.ingestStats   = dict()
+        # ingestLast: input id -> time of last passed event
+        self.ingestLast    = dict()
+        # ingestPending: input id -> [task, oldest arg, newest arg, due time]
+        self.ingestPending = dict()
+
+        self.expression = None
+        if self.logic == 'expression':
+            self.expression = Expression(instance.pluginProps.get('expression',''), instance.pluginProps)
+            self.expression.load()
+
+        self.taskTime = time.time()
 
-        self.logic      = instance.pluginProps.get('logicType','simple')
-        self.reverse    = instance.pluginProps.get('reverseBoolean',False)
-        self.valType    = instance.pluginProps.get('valueType','str')
-        self.operator   = instance.pluginProps.get('operator','eq')
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        """Read settings that can change without restarting the timer"""
+        # current settings, dev.pluginProps is as of when the timer started
+        self.props      = props
+        self.logic      = props.get('logicType','simple')
+        self.reverse    = props.get('reverseBoolean',False)
+        self.valType    = props.get('valueType','str')
+        self.operator   = props.get('operator','eq')
+        self.offValue   = None
+        self.deadband   = 0.0
         if self.logic == 'complex' and self.valType == 'num':
-            self.value = float(instance.pluginProps.get('value',''))
+            self.value = float(props.get('value',''))
+            if props.get('offValue','').strip():
+                self.offValue = float(props['offValue'])
+            if props.get('deadband','').strip():
+                self.deadband = float(props['deadband'])
         else:
-            self.value = instance.pluginProps.get('value','').lower()
+            self.value = props.get('value','').lower()
 
-        self.logOnOff  = instance.pluginProps.get('logOnOff',True)
+        self.logOnOff  = props.get('logOnOff',True)
 
+        # deviceStateDict: device id -> watched state keys, a device in several slots is one input
         self.deviceStateDict = dict()
         for deviceKey, stateKey in k_deviceKeys:
-            if zint(instance.pluginProps.get(deviceKey,'')):
-                self.deviceStateDict[int(instance.pluginProps[deviceKey])] = instance.pluginProps[stateKey]
+            if zint(props.get(deviceKey,'')):
+                stateKeys = self.deviceStateDict.get(int(props[deviceKey]), ())
+                if props[stateKey] not in stateKeys:
+                    self.deviceStateDict[int(props[deviceKey])] = stateKeys + (props[stateKey],)
 
         self.variableList = list()
         for variableKey in k_variableKeys:
-            if zint(instance.pluginProps.get(variableKey,'')):
-                self.variableList.append(int(instance.pluginProps[variableKey]))
+            if zint(props.get(variableKey,'')):
+                self.variableList.append(int(props[variableKey]))
 
-        self.taskTime = time.time()
+        self.ingestPolicy  = props.get('ingestPolicy','none')
+        self.ingestSeconds = float(props.get('ingestSeconds','') or 0)
+
+        self.windowActions = (props.get('windowEndAction','none'), props.get('windowStartAction','none'))
+
+    #-------------------------------------------------------------------------------
+    def reconfigure(self, props):
+        """Apply changed settings in place, keeping counts, deadlines and totals"""
+        oldInputs = (self.deviceStateDict, self.variableList)
+        oldComparison = self.comparisonKey()
+        self.configure(props)
+        if self.comparisonKey() != oldComparison:
+            # remembered results were judged against the old thresholds
+            self.inputMemory = dict()
+        if (self.deviceStateDict, self.variableList) != oldInputs:
+            self.inputsChanged()
+            # rebuilt on next use, now that this timer tracks its new inputs
+            self.plugin.dependents = None
+        # comparisons may have changed
+        self.plugin.predicates = None
+        self.trace('reconfigured')
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def trace(self, msg, *args, verbose=False):
+        """Record to the trace buffer, and to the debug log without formatting unless it is emitted"""
+        self.traceBuffer.append((time.time(), msg, args))
+        if self.plugin.verbose or not verbose:
+            self.logger.debug('"%s" ' + msg, self.name, *args)
+
+    #-------------------------------------------------------------------------------
+    def useSingleEntity(self, props):
+        """Single entity timers only track the selected device or variable"""
+        if self.logic != 'expression':
+            if props.get('trackEntity','dev') == 'dev':
+                self.variableList = list()
+            else:
+                self.deviceStateDict = dict()
+
+    #-------------------------------------------------------------------------------
+    def getEntityValue(self):
+        """Current input value of a single entity timer"""
+        if self.expression:
+            return self.expression.result
+        elif self.deviceStateDict:
+            devId, stateKeys = list(self.deviceStateDict.items())[0]
+            return self.getBoolValue(indigo.devices[devId].states[stateKeys[0]])
+        else:
+            return self.getBoolValue(indigo.variables[self.variableList[0]].value)
 
     #-------------------------------------------------------------------------------
     # properties
@@ -442,28 +1537,13 @@ class TimerBase(threading.Thread):
 
     #-------------------------------------------------------------------------------
     def run(self):
-        self.logger.debug(f'"{self.name}" thread started')
+        self.trace('thread started')
         while not self.cancelled:
             try:
                 task,arg1,arg2 = self.queue.get(True,5)
-                self.taskTime = time.time()
-                if task == 'tick':
-                    self.tick()
-                elif task == 'tock':
-                    self.tock(arg1)
-                elif task == 'devChanged':
-                    self.devChanged(arg1,arg2)
-                elif task == 'varChanged':
-                    self.varChanged(arg1,arg2)
-                elif task == 'turnOn':
-                    self.turnOn()
-                elif task == 'turnOff':
-                    self.turnOff()
-                elif task == 'cancel':
-                    self.cancelled = True
-                else:
-                    self.logger.error(f'"{self.name}" task "{task}" not recognized')
-                self.queue.task_done()
+                self.runTask(task,arg1,arg2)
+                if self.shadows:
+                    self.runShadows(task,arg1,arg2)
             except queue.Empty:
                 pass
             except Exception as e:
@@ -473,7 +1553,59 @@ class TimerBase(threading.Thread):
                 else:
                     self.logger.error(msg)
         else:
-            self.logger.debug(f'"{self.name}" thread cancelled')
+            self.trace('thread cancelled')
+
+    #-------------------------------------------------------------------------------
+    @profiled
+    def runTask(self, task, arg1, arg2, taskTime=None):
+        self.taskTime = taskTime or time.time()
+        if task in ['turnOn','turnOff'] and arg1:
+            # group actions share one task time
+            self.taskTime = arg1
+        if task == 'tick':
+            self.tick()
+        elif task == 'tock':
+            self.tock(arg1)
+        elif task == 'devChanged':
+            self.devChanged(arg1,arg2)
+        elif task == 'varChanged':
+            self.varChanged(arg1,arg2)
+        elif task == 'edge':
+            self.inputEdge(arg1,arg2)
+        elif task == 'window':
+            self.windowChanged(arg1)
+        elif task == 'attach':
+            self.shadows.append(arg1)
+            self.plugin.predicates = None
+        elif task == 'detach':
+            self.shadows = list()
+            self.plugin.predicates = None
+        elif task == 'turnOn':
+            self.turnOn()
+        elif task == 'turnOff':
+            self.turnOff()
+        elif task == 'reconfigure':
+            self.reconfigure(arg1)
+        elif task == 'cancel':
+            self.cancelled = True
+        else:
+            self.logger.error(f'"{self.name}" task "{task}" not recognized')
+
+    #-------------------------------------------------------------------------------
+    def runShadows(self, task, arg1, arg2):
+        """Hand the task just run to each shadow as of the same moment, then compare on states"""
+        for shadow in self.shadows:
+            try:
+                if task == 'reconfigure':
+                    shadow.runTask(task, shadow_props(arg1, shadow.dev.overrides), arg2, self.taskTime)
+                elif task not in ['attach','detach','cancel']:
+                    shadow.runTask(task, arg1, arg2, self.taskTime)
+                # shadows have no thread of their own, so run anything they queued for themselves
+                while not shadow.queue.empty():
+                    shadow.runTask(*shadow.queue.get_nowait(), self.taskTime)
+                shadow.dev.compare(self.onState, shadow.onState, self.taskTime)
+            except Exception as e:
+                self.logger.error(f'"{shadow.name}" error \n{e}')
 
     #-------------------------------------------------------------------------------
     def cancel(self):
@@ -484,40 +1616,180 @@ class TimerBase(threading.Thread):
     def doTask(self, task, arg1=None, arg2=None):
         self.queue.put((task, arg1, arg2))
 
+    #-------------------------------------------------------------------------------
+    def ingest(self, task, old, new):
+        """Filter input changes in the dispatching thread, then queue the survivors"""
+        if not self.windowOpen:
+            return
+        elif task == 'devChanged':
+            if new.id not in self.deviceStateDict:
+                return
+        elif new.id not in self.variableList:
+            return
+
+        now = time.time()
+        with self.ingestLock:
+            stats = self.ingestStats.setdefault(new.id, [0,0])
+            if self.ingestPolicy == 'changed':
+                passed = self.ingestValue(task, old) != self.ingestValue(task, new)
+            elif self.ingestPolicy == 'interval':
+                passed = now - self.ingestLast.get(new.id, 0) >= self.ingestSeconds
+            elif self.ingestPolicy == 'debounce':
+                pending = self.ingestPending.get(new.id)
+                if pending:
+                    # keep the oldest value so the comparison sees the net change
+                    stats[1] += 1
+                    pending[2] = new
+                    pending[3] = now + self.ingestSeconds
+                else:
+                    self.ingestPending[new.id] = [task, old, new, now + self.ingestSeconds]
+                return
+            else:
+                passed = True
+
+            if passed:
+                stats[0] += 1
+                self.ingestLast[new.id] = now
+            else:
+                stats[1] += 1
+                return
+        self.doTask(task, old, new)
+
+    #-------------------------------------------------------------------------------
+    def flushIngest(self, now):
+        """Queue debounced changes that have been quiet long enough"""
+        if self.ingestPending:
+            with self.ingestLock:
+                for inputId, (task, old, new, due) in list(self.ingestPending.items()):
+                    if now >= due:
+                        del self.ingestPending[inputId]
+                        self.ingestStats[inputId][0] += 1
+                        self.ingestLast[inputId] = now
+                        self.doTask(task, old, new)
+
+    #-------------------------------------------------------------------------------
+    def ingestValue(self, task, entity):
+        if task == 'devChanged':
+            return [entity.states.get(stateKey) for stateKey in self.deviceStateDict.get(entity.id, ())]
+        else:
+            return entity.value
+
     #-------------------------------------------------------------------------------
     def devChanged(self, oldDev, newDev):
-        if newDev.id in self.deviceStateDict:
-            stateKey = self.deviceStateDict[newDev.id]
-            result = self.doInputComparison(oldDev.states[stateKey], newDev.states[stateKey])
-            if self.plugin.verbose:
-                self.logger.debug(f'"{self.name}" devChanged:"{newDev.name}" [state:{stateKey}, value:{newDev.states[stateKey]}, type:{type(newDev.states[stateKey])}, result:{result}]')
+        self.lastInput = (newDev.id, newDev.name)
+        if self.expression:
+            result = self.expression.devChanged(newDev)
+            self.trace('devChanged:"%s" [expression:%s, result:%s]', newDev.name, self.expression.text, result, verbose=True)
             if result is not None:
                 self.tock(result)
+        elif newDev.id in self.deviceStateDict:
+            # every watched state is its own input, all evaluated against this one update
+            for stateKey in self.deviceStateDict[newDev.id]:
+                value = newDev.states[stateKey]
+                result = self.doInputComparison(oldDev.states[stateKey], value, (newDev.id, stateKey))
+                # %r shows the value's type when the record is formatted, so nothing is built here
+                self.trace('devChanged:"%s" [state:%s, value:%r, result:%s]', newDev.name, stateKey, value, result, verbose=True)
+                if result is not None:
+                    self.tock(result)
 
     #-------------------------------------------------------------------------------
     def varChanged(self, oldVar, newVar):
-        if newVar.id in self.variableList:
-            result = self.doInputComparison(oldVar.value, newVar.value)
-            if self.plugin.verbose:
-                self.logger.debug(f'"{self.name}" varChanged:"{newVar.name}" [value:{newVar.value}, type:{type(newVar.value)}, result:{result}]')
+        self.lastInput = (newVar.id, newVar.name)
+        if self.expression:
+            result = self.expression.varChanged(newVar)
+            self.trace('varChanged:"%s" [expression:%s, result:%s]', newVar.name, self.expression.text, result, verbose=True)
+            if result is not None:
+                self.tock(result)
+        elif newVar.id in self.variableList:
+            value = newVar.value
+            result = self.doInputComparison(oldVar.value, value, newVar.id)
+            self.trace('varChanged:"%s" [value:%r, result:%s]', newVar.name, value, result, verbose=True)
             if result is not None:
                 self.tock(result)
 
     #-------------------------------------------------------------------------------
-    def doInputComparison(self, oldValue, newValue):
-        if self.logic == 'any':
-            if oldValue != newValue:
-                return True
+    def inputEdge(self, results, entity):
+        """Results of shared predicates for one input change, already evaluated by the plugin"""
+        self.lastInput = (entity.id, entity.name)
+        for result in results:
+            self.trace('edge:"%s" [result:%s]', entity.name, result, verbose=True)
+            self.tock(result)
+
+    #-------------------------------------------------------------------------------
+    def windowChanged(self, isOpen):
+        self.trace('window:%s', 'open' if isOpen else 'closed')
+        if isOpen:
+            # inputs were dropped while the window was closed
+            if self.expression:
+                self.expression.load()
+            self.inputsChanged()
+        action = self.windowActions[isOpen]
+        if action == 'turnOn':
+            self.turnOn()
+        elif action == 'turnOff':
+            self.turnOff()
         else:
-            new = self.getBoolValue(newValue)
-            old = self.getBoolValue(oldValue)
+            self.update()
+
+    #-------------------------------------------------------------------------------
+    def sharesPredicates(self):
+        """True if every input is a plain comparison the plugin can evaluate for this timer"""
+        # shadows may compare differently, so they need the raw changes
+        return (self.logic != 'expression' and self.ingestPolicy == 'none' and not self.shadows
+            and type(self).devChanged is TimerBase.devChanged and type(self).varChanged is TimerBase.varChanged)
+
+    #-------------------------------------------------------------------------------
+    def comparisonKey(self):
+        return (self.logic, self.reverse, self.valType, self.operator, self.value, self.offValue, self.deadband)
+
+    #-------------------------------------------------------------------------------
+    def doInputComparison(self, oldValue, newValue, key=None, memory=None):
+        if self.logic == 'any':
+            if oldValue != newValue:
+                return True
+        elif key is not None and (self.offValue is not None or self.deadband):
+            return self.doHysteresisComparison(oldValue, newValue, key, self.inputMemory if memory is None else memory)
+        else:
+            new = self.getBoolValue(newValue)
+            old = self.getBoolValue(oldValue)
             if new != old:
                 return new
             else:
                 return None
 
     #-------------------------------------------------------------------------------
-    def getBoolValue(self, value):
+    def doHysteresisComparison(self, oldValue, newValue, key, memory):
+        try:
+            number = float(newValue)
+        except (TypeError, ValueError):
+            self.logger.error(f'Data type error for device "{self.name}" [value:{newValue}, type:{type(newValue)}]')
+            return None
+
+        if key not in memory:
+            # first change seen for this input, so start from the prior value
+            try:
+                memory[key] = (float(oldValue), self.getBoolValue(oldValue))
+            except (TypeError, ValueError):
+                memory[key] = (float('nan'), False)
+        lastNumber, lastResult = memory[key]
+
+        if abs(number - lastNumber) < self.deadband:
+            return None
+
+        if lastResult and self.offValue is not None and self.operator in ['gt','lt','ge','le']:
+            # once on, stay on until the off value is crossed
+            result = self.getBoolValue(number, self.offValue)
+        else:
+            result = self.getBoolValue(number)
+        memory[key] = (number, result)
+
+        if result != lastResult:
+            return result
+        else:
+            return None
+
+    #-------------------------------------------------------------------------------
+    def getBoolValue(self, value, threshold=None):
         result = False
         error = False
 
@@ -537,6 +1809,8 @@ class TimerBase(threading.Thread):
                 result = not result
 
         elif self.logic == 'complex':
+            if threshold is None:
+                threshold = self.value
             try:
                 if self.valType == 'str':
                     adjVal = value.lower()
@@ -544,17 +1818,17 @@ class TimerBase(threading.Thread):
                     adjVal = float(value)
 
                 if   self.operator == 'eq':
-                    result = adjVal == self.value
+                    result = adjVal == threshold
                 elif self.operator == 'ne':
-                    result = adjVal != self.value
+                    result = adjVal != threshold
                 elif self.operator == 'gt':
-                    result = adjVal >  self.value
+                    result = adjVal >  threshold
                 elif self.operator == 'lt':
-                    result = adjVal <  self.value
+                    result = adjVal <  threshold
                 elif self.operator == 'ge':
-                    result = adjVal >= self.value
+                    result = adjVal >= threshold
                 elif self.operator == 'le':
-                    result = adjVal <= self.value
+                    result = adjVal <= threshold
 
             except ValueError as e:
                 error = True
@@ -566,25 +1840,58 @@ class TimerBase(threading.Thread):
 
     #-------------------------------------------------------------------------------
     def update(self):
-        if self.plugin.showTimer or (self.states != self.dev.states):
+        # batched timers compare against what they last handed to the plugin, which the server may not have yet
+        batch = self.plugin.batchWrites and not self.shadow
+        if batch and self.written is not None:
+            devStates = self.written
+        else:
+            # dev.states builds a fresh copy on every access, so take it once
+            devStates = self.dev.states
+            self.written = None
+        if batch or self.plugin.showTimer or (self.states != devStates):
 
             self.getStates()
 
             newStates = list()
+            image = None
             for key, value in self.states.iteritems():
-                if self.states[key] != self.dev.states[key]:
+                if value != devStates[key]:
                     newStates.append({'key':key,'value':value})
-                    if key == 'onOffState' and self.logOnOff:
-                        self.logger.info(f'"{self.name}" {["off","on"][value]}')
+                    if key == 'onOffState':
+                        self.queueEvent(['timerOff','timerOn'][value])
+                        if self.logOnOff and not self.shadow:
+                            self.logger.info(f'"{self.name}" {["off","on"][value]}')
                     elif key == 'state':
-                        self.dev.updateStateImageOnServer(k_stateImages[self.stateImg])
+                        image = self.stateImg
+                        if not batch:
+                            self.dev.updateStateImageOnServer(k_stateImages[image])
+
+            self.trace('states: %s', tuple((item['key'], item['value']) for item in newStates), verbose=True)
+
+            # a timer isn't registered while it's built, deviceStartComm propagates its first update
+            registered = self.plugin.deviceDict.get(self.id) is self
+            if newStates and not self.shadow and registered and self.plugin.getDependents(self.id)[0]:
+                oldDev = DeviceSnapshot(self.dev, devStates)
+                newDev = DeviceSnapshot(self.dev, self.states)
+                self.plugin.propagate(self.id, oldDev, newDev)
+
+            if batch:
+                if newStates:
+                    self.plugin.queueWrite(self.dev, newStates, image)
+                self.written = dict(self.states)
+            else:
+                self.dev.updateStatesOnServer(newStates)
+                self.states = self.dev.states
 
-            if self.plugin.verbose:
-                logStates = ", ".join(f'{item["key"]}:{item["value"]}' for item in newStates)
-                self.logger.debug(f'"{self.name}" states: [{logStates.strip(", ")}]')
+        if self.events:
+            events, self.events = self.events, list()
+            if not self.shadow:
+                for eventId, span in events:
+                    self.plugin.fireEvent(eventId, self.id, span)
 
-            self.dev.updateStatesOnServer(newStates)
-            self.states = self.dev.states
+    #-------------------------------------------------------------------------------
+    def queueEvent(self, eventId, span=None):
+        self.events.append((eventId, span))
 
     #-------------------------------------------------------------------------------
     def delta(self, cycles, units):
@@ -621,21 +1928,36 @@ class TimerBase(threading.Thread):
 
 ################################################################################
 class ActivityTimer(TimerBase):
+    __slots__ = ('offDelta', 'resetDelta', 'threshold', 'extend', 'distinct', 'lastSeen')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(ActivityTimer, self).__init__(instance, plugin)
 
-        self.threshold  = int(instance.pluginProps.get('countThreshold',1))
-        self.extend     = instance.pluginProps.get('extend',True)
-        self.resetDelta = self.delta( instance.pluginProps.get('resetCycles',1),
-                                      instance.pluginProps.get('resetUnits','minutes') )
-        self.offDelta   = self.delta( instance.pluginProps.get('offCycles', 10),
-                                      instance.pluginProps.get('offUnits',  'minutes') )
+        # lastSeen: input id -> (expiry time, name), oldest expiry first
+        self.lastSeen = OrderedDict()
+        if self.distinct:
+            try:
+                self.lastSeen.update(sorted(literal_eval(self.states['zzzLastSeen']).items(), key=lambda item: item[1][0]))
+            except:
+                pass
+            self.expireInputs()
 
         # initial state
         self.tick()
 
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(ActivityTimer, self).configure(props)
+
+        self.threshold  = int(props.get('countThreshold',1))
+        self.distinct   = props.get('countMode','events') == 'distinct'
+        self.extend     = props.get('extend',True)
+        self.resetDelta = self.delta( props.get('resetCycles',1),
+                                      props.get('resetUnits','minutes') )
+        self.offDelta   = self.delta( props.get('offCycles', 10),
+                                      props.get('offUnits',  'minutes') )
+
     #-------------------------------------------------------------------------------
     # properties
     #-------------------------------------------------------------------------------
@@ -676,28 +1998,41 @@ class ActivityTimer(TimerBase):
     def tick(self):
         reset = expired = False
         if self.count and (self.taskTime >= self.resetTime):
-            self.count = 0
-            self.reset = True
+            if self.distinct:
+                self.expireInputs()
+            else:
+                self.count = 0
+            self.reset = not self.count
             logTimer = 'resetTime'
         if self.onState and (self.taskTime >= self.offTime):
             self.onState = False
             self.expired = True
+            self.queueEvent('timerExpired')
             logTimer = 'offTime'
         if reset or expired:
-            self.logger.debug(f'"{self.name}" timer:{logTimer} [onOff:{self.onState}, count:{self.count}, reset:{self.reset}, expired:{self.expired}]')
+            self.trace('timer:%s [onOff:%s, count:%s, reset:%s, expired:%s]', logTimer, self.onState, self.count, self.reset, self.expired)
         self.update()
 
     #-------------------------------------------------------------------------------
     def tock(self, newVal):
         if newVal:
-            self.count += 1
-            self.resetTime = self.taskTime + self.resetDelta
+            lastCount = self.count
+            if self.distinct:
+                inputId, name = self.lastInput
+                self.lastSeen.pop(inputId, None)
+                self.lastSeen[inputId] = (self.taskTime + self.resetDelta, name)
+                self.saveInputs()
+            else:
+                self.count += 1
+                self.resetTime = self.taskTime + self.resetDelta
+            if self.count == self.threshold and self.count > lastCount:
+                self.queueEvent('thresholdReached')
             if self.count >= self.threshold:
                 self.onState = True
                 self.offTime = self.taskTime + self.offDelta
             elif self.onState and self.extend:
                 self.offTime = self.taskTime + self.offDelta
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}, count:{self.count}, reset:{self.reset}, expired:{self.expired}]')
+        self.trace('input processed:%s [onOff:%s, count:%s, reset:%s, expired:%s]', newVal, self.onState, self.count, self.reset, self.expired)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -711,11 +2046,33 @@ class ActivityTimer(TimerBase):
         if self.count:
             self.count = 0
             self.resetTime = self.taskTime
+        if self.lastSeen:
+            self.lastSeen = OrderedDict()
+            self.saveInputs()
         if self.onState:
             self.onState = False
             self.offTime = self.taskTime
         self.update()
 
+    #-------------------------------------------------------------------------------
+    def expireInputs(self):
+        """Drop inputs whose window has passed, every expiry is the same delta so the oldest go first"""
+        expired = False
+        while self.lastSeen and next(iter(self.lastSeen.values()))[0] <= self.taskTime:
+            self.lastSeen.popitem(last=False)
+            expired = True
+        if expired or self.count != len(self.lastSeen):
+            self.saveInputs()
+
+    #-------------------------------------------------------------------------------
+    def saveInputs(self):
+        self.count = len(self.lastSeen)
+        if self.lastSeen:
+            # next input to drop out sets the reset time
+            self.resetTime = next(iter(self.lastSeen.values()))[0]
+        self.states['contributors'] = ', '.join(name for expiry, name in self.lastSeen.values())
+        self.states['zzzLastSeen'] = repr(dict(self.lastSeen))
+
     #-------------------------------------------------------------------------------
     def getStates(self):
         if self.onState:
@@ -745,31 +2102,57 @@ class ActivityTimer(TimerBase):
 
 ################################################################################
 class ThresholdTimer(TimerBase):
+    __slots__ = ('offDelta', 'resetDelta', 'threshold', 'trackCount')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(ThresholdTimer, self).__init__(instance, plugin)
 
-        self.threshold  = int(instance.pluginProps.get('countThreshold',1))
-        self.resetDelta = self.delta( instance.pluginProps.get('resetCycles',1),
-                                      instance.pluginProps.get('resetUnits','minutes') )
-        self.offDelta   = self.delta( instance.pluginProps.get('offCycles', 10),
-                                      instance.pluginProps.get('offUnits',  'minutes') )
-
-        self.trackCount = len(self.deviceStateDict) + len(self.variableList)
-
         # initial state
-        self.count = 0
-        for devId, stateId in list(self.deviceStateDict.items()):
-            if self.getBoolValue(indigo.devices[devId].states[stateId]):
-                self.count += 1
-        for varId in self.variableList:
-            if self.getBoolValue(indigo.variables[varId].value):
-                self.count += 1
+        self.countInputs()
         if (self.count >= self.threshold) or (self.taskTime < self.offTime):
             self.onState = True
         self.update()
 
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(ThresholdTimer, self).configure(props)
+
+        self.threshold  = int(props.get('countThreshold',1))
+        self.resetDelta = self.delta( props.get('resetCycles',1),
+                                      props.get('resetUnits','minutes') )
+        self.offDelta   = self.delta( props.get('offCycles', 10),
+                                      props.get('offUnits',  'minutes') )
+
+        if self.logic == 'expression':
+            # the expression is a single input
+            self.trackCount = 1
+        else:
+            self.trackCount = sum(len(stateKeys) for stateKeys in self.deviceStateDict.values()) + len(self.variableList)
+
+    #-------------------------------------------------------------------------------
+    def countInputs(self):
+        self.count = 0
+        if self.expression:
+            self.count = int(self.expression.result)
+        else:
+            for devId, stateKeys in list(self.deviceStateDict.items()):
+                states = indigo.devices[devId].states
+                for stateKey in stateKeys:
+                    if self.getBoolValue(states[stateKey]):
+                        self.count += 1
+            for varId in self.variableList:
+                if self.getBoolValue(indigo.variables[varId].value):
+                    self.count += 1
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        self.countInputs()
+        if self.count >= self.threshold:
+            self.onState = True
+        elif (self.state == 'active'):
+            self.offTime = self.taskTime + self.offDelta
+
     #-------------------------------------------------------------------------------
     # properties
     #-------------------------------------------------------------------------------
@@ -805,7 +2188,8 @@ class ThresholdTimer(TimerBase):
         if (self.state == 'persist') and (self.taskTime >= self.offTime):
             self.onState = False
             self.expired = True
-            self.logger.debug(f'"{self.name}" timer:offTime [onOff:{self.onState}, count:{self.count}, expired:{self.expired}]')
+            self.queueEvent('timerExpired')
+            self.trace('timer:offTime [onOff:%s, count:%s, expired:%s]', self.onState, self.count, self.expired)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -815,6 +2199,8 @@ class ThresholdTimer(TimerBase):
             if self.count > self.trackCount:
                 self.logger.error(f'"{self.name}" count out of sync [count:{self.count}, max:{self.trackCount}]')
                 self.count = self.trackCount
+            if self.count == self.threshold:
+                self.queueEvent('thresholdReached')
             if self.count >= self.threshold:
                 self.onState = True
         else:
@@ -824,7 +2210,7 @@ class ThresholdTimer(TimerBase):
                 self.count = 0
             if (self.state == 'active') and (self.count < self.threshold):
                 self.offTime = self.taskTime + self.offDelta
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}, count:{self.count}, expired:{self.expired}]')
+        self.trace('input processed:%s [onOff:%s, count:%s, expired:%s]', newVal, self.onState, self.count, self.expired)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -868,25 +2254,29 @@ class ThresholdTimer(TimerBase):
 
 ################################################################################
 class PersistenceTimer(TimerBase):
+    __slots__ = ('onDelta', 'offDelta')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(PersistenceTimer, self).__init__(instance, plugin)
 
-        self.onDelta  = self.delta( instance.pluginProps.get('onCycles',30),
-                                    instance.pluginProps.get('onUnits','seconds') )
-        self.offDelta = self.delta( instance.pluginProps.get('offCycles',30),
-                                    instance.pluginProps.get('offUnits','seconds') )
-
         # initial state
         self.tick()
-        if instance.pluginProps['trackEntity'] == 'dev':
-            devId, state = list(self.deviceStateDict.items())[0]
-            self.tock(self.getBoolValue(indigo.devices[devId].states[state]))
-            self.variableList = list()
-        else:
-            self.tock(self.getBoolValue(indigo.variables[self.variableList[0]].value))
-            self.deviceStateDict = dict()
+        self.tock(self.getEntityValue())
+
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(PersistenceTimer, self).configure(props)
+        self.useSingleEntity(props)
+
+        self.onDelta  = self.delta( props.get('onCycles',30),
+                                    props.get('onUnits','seconds') )
+        self.offDelta = self.delta( props.get('offCycles',30),
+                                    props.get('offUnits','seconds') )
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        self.tock(self.getEntityValue())
 
     #-------------------------------------------------------------------------------
     # properties
@@ -923,7 +2313,7 @@ class PersistenceTimer(TimerBase):
                 self.onState = True
                 logTimer = 'onTime'
             if not self.pending:
-                self.logger.debug(f'"{self.name}" timer:{logTimer} [onOff:{self.onState}, pending:{self.pending}]')
+                self.trace('timer:%s [onOff:%s, pending:%s]', logTimer, self.onState, self.pending)
             self.update()
 
     #-------------------------------------------------------------------------------
@@ -945,7 +2335,7 @@ class PersistenceTimer(TimerBase):
                 else:
                     self.onState = True
                     self.onTime = self.taskTime
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}, pending:{self.pending}]')
+        self.trace('input processed:%s [onOff:%s, pending:%s]', newVal, self.onState, self.pending)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -989,26 +2379,30 @@ class PersistenceTimer(TimerBase):
 
 ################################################################################
 class LockoutTimer(TimerBase):
+    __slots__ = ('onDelta', 'offDelta', 'lastVal')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(LockoutTimer, self).__init__(instance, plugin)
 
-        self.onDelta  = self.delta( instance.pluginProps.get('onCycles',30),
-                                    instance.pluginProps.get('onUnits','seconds') )
-        self.offDelta = self.delta( instance.pluginProps.get('offCycles',30),
-                                    instance.pluginProps.get('offUnits','seconds') )
-
         # initial state
         self.lastVal = self.onState
         self.tick()
-        if instance.pluginProps['trackEntity'] == 'dev':
-            devId, state = list(self.deviceStateDict.items())[0]
-            self.tock(self.getBoolValue(indigo.devices[devId].states[state]))
-            self.variableList = list()
-        else:
-            self.tock(self.getBoolValue(indigo.variables[self.variableList[0]].value))
-            self.deviceStateDict = dict()
+        self.tock(self.getEntityValue())
+
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(LockoutTimer, self).configure(props)
+        self.useSingleEntity(props)
+
+        self.onDelta  = self.delta( props.get('onCycles',30),
+                                    props.get('onUnits','seconds') )
+        self.offDelta = self.delta( props.get('offCycles',30),
+                                    props.get('offUnits','seconds') )
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        self.tock(self.getEntityValue())
 
     #-------------------------------------------------------------------------------
     # properties
@@ -1043,7 +2437,8 @@ class LockoutTimer(TimerBase):
                 self.locked = False
                 logTimer = 'offTime'
             if not self.locked:
-                self.logger.debug(f'"{self.name}" timer:{logTimer} [onOff:{self.onState}, locked:{self.locked}]')
+                self.queueEvent('lockoutReleased')
+                self.trace('timer:%s [onOff:%s, locked:%s]', logTimer, self.onState, self.locked)
             self.update()
             if not self.locked:
                 self.doTask('tock', self.lastVal)
@@ -1059,7 +2454,7 @@ class LockoutTimer(TimerBase):
                     self.onTime  = self.taskTime + self.onDelta
                 else:
                     self.offTime = self.taskTime + self.offDelta
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}, locked:{self.locked}]')
+        self.trace('input processed:%s [onOff:%s, locked:%s]', newVal, self.onState, self.locked)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -1103,28 +2498,33 @@ class LockoutTimer(TimerBase):
 
 ################################################################################
 class AliveTimer(TimerBase):
+    __slots__ = ('offDelta',)
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(AliveTimer, self).__init__(instance, plugin)
 
-        self.offDelta = self.delta( instance.pluginProps.get('offCycles',30),
-                                    instance.pluginProps.get('offUnits','seconds') )
-
         # initial state
         if instance.pluginProps['trackEntity'] == 'dev':
-            devId, state = list(self.deviceStateDict.items())[0]
+            devId = list(self.deviceStateDict)[0]
             lastDateTime = indigo.devices[devId].lastChanged
             lastTimeTime = time.mktime(lastDateTime.timetuple())
             self.offTime = lastTimeTime + self.offDelta
             self.onState = (time.time() < self.offTime)
-            self.variableList = list()
         else:
             # no last changed data available for variables
             # onState initialized to whatever it was before
-            self.deviceStateDict = dict()
+            pass
         self.tick()
 
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(AliveTimer, self).configure(props)
+        self.useSingleEntity(props)
+
+        self.offDelta = self.delta( props.get('offCycles',30),
+                                    props.get('offUnits','seconds') )
+
     #-------------------------------------------------------------------------------
     # Properties
     #-------------------------------------------------------------------------------
@@ -1139,14 +2539,15 @@ class AliveTimer(TimerBase):
     def tick(self):
         if self.onState and self.taskTime >= self.offTime:
             self.onState = False
-            self.logger.debug(f'"{self.name}" timer:offTime [onOff:{self.onState}]')
+            self.queueEvent('timerExpired')
+            self.trace('timer:offTime [onOff:%s]', self.onState)
         self.update()
 
     #-------------------------------------------------------------------------------
     def tock(self, newVal):
         self.onState = True
         self.offTime = self.taskTime + self.offDelta
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}]')
+        self.trace('input processed:%s [onOff:%s]', newVal, self.onState)
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -1180,85 +2581,91 @@ class AliveTimer(TimerBase):
     #-------------------------------------------------------------------------------
     def devChanged(self, oldDev, newDev):
         if newDev.id in self.deviceStateDict:
-            if self.plugin.verbose:
-                self.logger.debug(f'"{self.name}" devChanged:"{newDev.name}"')
+            self.trace('devChanged:"%s"', newDev.name, verbose=True)
             self.tock(True)
 
     #-------------------------------------------------------------------------------
     def varChanged(self, oldVar, newVar):
         if newVar.id in self.variableList:
-            if self.plugin.verbose:
-                self.logger.debug(f'"{self.name}" varChanged:"{newVar.name}"')
+            self.trace('varChanged:"%s"', newVar.name, verbose=True)
             self.tock(True)
 
 ################################################################################
 class RunningTimer(TimerBase):
+    __slots__ = ('updateDelta', 'updateTime', 'cycleStats', 'cycle_stats', 'archiveSpans',
+                 'spanSlots', 'spanStrings', 'spanKeys', 'spanNames', 'spanLayout', 'spanTotals',
+                 'spanLegacy', 'customSpans', 'running_spans', 'task_spans', 'save_spans',
+                 'start_spans', 'done_spans')
 
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(RunningTimer, self).__init__(instance, plugin)
 
-        self.updateDelta = int(instance.pluginProps.get('updateSeconds',60))
         self.updateTime  = 0
 
-        if instance.pluginProps['trackEntity'] == 'dev':
-            devId, state = list(self.deviceStateDict.items())[0]
+        if self.expression:
+            self.onState = self.expression.result
+        elif instance.pluginProps['trackEntity'] == 'dev':
+            devId, stateKeys = list(self.deviceStateDict.items())[0]
             dev = indigo.devices[devId]
             lastDateTime = dev.lastChanged
             lastTimeTime = time.mktime(lastDateTime.timetuple())
-            self.onState = self.getBoolValue(dev.states[state])
+            self.onState = self.getBoolValue(dev.states[stateKeys[0]])
             if self.onState:
                 self.onTime = max(self.onTime,lastTimeTime)
-            self.variableList = list()
         else:
             self.onState = self.getBoolValue(indigo.variables[self.variableList[0]].value)
-            self.deviceStateDict = dict()
 
 
         # INITIALIZE TIMESPAN DICTIONARIES
-        # task_spans: numerical timespans of current task
-        self.task_spans = dict()
+        # task_spans: numerical timespans of current task, custom spans by their start time
+        self.task_spans = SpanValues('q', spans=self.spanKeys)
         self.updateTaskSpans()
 
         # save_spans: numerical timespans last saved to device
         try:
-            self.save_spans = literal_eval(self.states['zzzSaveSpanDict'])
+            self.save_spans = SpanValues('q', literal_eval(self.states['zzzSaveSpanDict']), self.spanKeys)
         except:
-            self.save_spans = dict()
-        for span in k_timeSpans:
-            if not self.save_spans.get(span,None): self.save_spans[span] = self.task_spans[span]
+            self.save_spans = SpanValues('q', spans=self.spanKeys)
+        for span in self.spanKeys:
+            if not self.save_spans[span]: self.save_spans[span] = self.task_spans[span]
 
         # start_spans: epoch time for the start of current timespans
         year  = self.save_spans['y']
         month = self.save_spans['m']
         day   = self.save_spans['d']
         hour  = self.save_spans['h']
-        self.start_spans = {
+        self.start_spans = SpanValues('d', {
             'h': time.mktime(datetime(year, month, day, hour).timetuple()),
             'd': time.mktime(datetime(year, month, day).timetuple()),
             'm': time.mktime(datetime(year, month, 1).timetuple()),
             'y': time.mktime(datetime(year, 1, 1).timetuple()),
             'c': self.onTime,
-            }
+            }, self.spanKeys)
         self.start_spans['w'] = self.start_spans['d'] - (time.localtime(self.start_spans['d']).tm_wday*24*60*60)
+        for span in self.customSpans:
+            self.start_spans[span] = self.save_spans[span]
 
         # done_spans: accumulated seconds for each current timespan already saved to device's states
         try:
-            self.done_spans = literal_eval(self.states['zzzSecsDoneDict'])
+            self.done_spans = SpanValues('d', literal_eval(self.states['zzzSecsDoneDict']), self.spanKeys)
+        except:
+            self.done_spans = SpanValues('d', spans=self.spanKeys)
+
+        # cycle_stats: on-cycle aggregates for each current timespan
+        self.cycleStats = instance.pluginProps.get('cycleStats',False)
+        try:
+            self.cycle_stats = CycleStats(literal_eval(self.states['zzzCycleStats']))
         except:
-            self.done_spans = dict()
-        for span in k_timeSpans:
-            if not self.done_spans.get(span,None): self.done_spans[span] = 0
+            self.cycle_stats = CycleStats()
 
         # running_spans: total accumulated seconds for each current and prior timespan
-        self.running_spans = dict()
-        for span, name in k_timeSpans.items():
-            self.running_spans[span] = {i:self.states[f'seconds{name}{i:02}'] for i in range(k_periodRange[span])}
+        self.running_spans = SpanHistory(self.states, self.spanLayout)
         self.updateRunningSpans()
 
 
         # INITALIZE DEVICE STATES
-        for span in k_timeSpans:
+        for span in self.spanKeys:
             if self.task_spans[span] != self.save_spans[span]:
                 # we are now in a new time span
                 # estimate inital accumulated seconds for new span
@@ -1268,16 +2675,42 @@ class RunningTimer(TimerBase):
                     self.done_spans[span] = 0
                 # set the accumulated seconds for the prior spans
                 self.rolloverSpan(span)
+                # new span starts with no completed cycles
+                self.cycle_stats.reset(span)
                 # start timer for new span now
                 self.start_spans[span] = self.taskTime
                 # save new span so we know when it changes again
                 self.save_spans[span] = self.task_spans[span]
 
-        if not self.onState and self.running_spans['c'][0]:
+        if not self.onState and self.running_spans.get('c'):
             self.rolloverSpan('c')
 
         self.saveSpanStates()
 
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(RunningTimer, self).configure(props)
+        self.useSingleEntity(props)
+
+        self.updateDelta = int(props.get('updateSeconds',60))
+        self.spanSlots, self.spanStrings, self.spanLegacy = state_profile(props)
+        self.archiveSpans = props.get('archiveSpans',False)
+
+        # custom spans are cold props, so the layout is fixed once the timer starts
+        if not hasattr(self, 'customSpans'):
+            self.customSpans = custom_spans(props)
+            self.spanNames   = dict(k_timeSpans, **{span:custom.name for span, custom in self.customSpans.items()})
+            self.spanLayout  = tuple((span, name, k_periodRange[span]) for span, name in k_timeSpans.items()) \
+                + tuple((span, custom.name, custom.slots) for span, custom in self.customSpans.items())
+            self.spanKeys    = tuple(span for span, name, slots in self.spanLayout)
+        self.spanSlots += tuple((span, custom.slots) for span, custom in self.customSpans.items())
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        newVal = self.getEntityValue()
+        if newVal != self.onState:
+            self.tock(newVal)
+
     #-------------------------------------------------------------------------------
     # Properties
     #-------------------------------------------------------------------------------
@@ -1308,15 +2741,17 @@ class RunningTimer(TimerBase):
             self.updateTime = self.taskTime + self.updateDelta
             logTimer = 'updateTime'
 
-        for span in k_timeSpans:
+        for span in self.spanKeys:
             if self.task_spans[span] != self.save_spans[span]:
                 # we are now in a new time span
-                if self.plugin.verbose:
-                    self.logger.debug(f'new span "{span}": {self.saved.spans[span]} -> {self.task.spans[span]}')
+                self.trace('new span "%s": %s -> %s', span, self.save_spans[span], self.task_spans[span], verbose=True)
                 # set the accumulated seconds for the prior spans
                 self.rolloverSpan(span)
                 # set inital accumulated seconds for new span to zero
                 self.done_spans[span] = 0
+                self.queueEvent('spanRollover', span)
+                # new span starts with no completed cycles
+                self.cycle_stats.reset(span)
                 # start timer for new span now
                 self.start_spans[span] = self.taskTime
                 # save new span so we know when it changes again
@@ -1325,7 +2760,7 @@ class RunningTimer(TimerBase):
                 logTimer = f'newSpan({span})'
 
         if logTimer:
-            self.logger.debug(f'"{self.name}" timer:{logTimer} [onOff:{self.onState}, onSec:{self.running_spans["c"][0]}, update:{self.updateTime}]')
+            self.trace('timer:%s [onOff:%s, onSec:%s, update:%s]', logTimer, self.onState, self.running_spans.get("c"), self.updateTime)
             self.saveSpanStates()
         elif self.plugin.showTimer:
             self.update()
@@ -1343,9 +2778,13 @@ class RunningTimer(TimerBase):
             # record time device went on
             self.onTime = self.taskTime
         else:
-            for span in k_timeSpans:
+            for span in self.spanKeys:
                 # save accumulated timer value
-                self.done_spans[span] = self.running_spans[span][0]
+                self.done_spans[span] = self.running_spans.get(span)
+
+            if self.onState:
+                # record completed on cycle, clamped to each span since earlier spans have rolled over
+                self.cycle_stats.add(tuple(self.taskTime - max(self.onTime, self.start_spans[span]) for span in k_cycleSpans))
 
             self.rolloverSpan('c')
 
@@ -1354,7 +2793,7 @@ class RunningTimer(TimerBase):
             # record time device went off
             self.offTime = self.taskTime
 
-        self.logger.debug(f'"{self.name}" input processed:{newVal} [onOff:{self.onState}]')
+        self.trace('input processed:%s [onOff:%s]', newVal, self.onState)
         self.saveSpanStates()
 
     #-------------------------------------------------------------------------------
@@ -1368,32 +2807,39 @@ class RunningTimer(TimerBase):
     #-------------------------------------------------------------------------------
     def updateTaskSpans(self):
         dt = datetime.fromtimestamp(self.taskTime)
-        self.task_spans = {
-            'h': dt.hour,
-            'd': dt.day,
-            'w': dt.isocalendar()[1],
-            'm': dt.month,
-            'y': dt.year,
-            'c': 0
-        }
+        self.task_spans['h'] = dt.hour
+        self.task_spans['d'] = dt.day
+        self.task_spans['w'] = dt.isocalendar()[1]
+        self.task_spans['m'] = dt.month
+        self.task_spans['y'] = dt.year
+        self.task_spans['c'] = 0
+        for span, custom in self.customSpans.items():
+            # boundaries are only worked out again once one has passed
+            if not custom.start <= self.taskTime < custom.end:
+                custom.locate(self.taskTime)
+            self.task_spans[span] = int(custom.start)
 
     #-------------------------------------------------------------------------------
     def updateRunningSpans(self):
-        for span in k_timeSpans:
+        for span in self.spanKeys:
             if self.onState:
                 accumulated = self.taskTime - max(self.onTime, self.start_spans[span])
             else:
                 accumulated = 0
             if span =='c':
-                self.running_spans[span][0] = accumulated
+                self.running_spans.set(span, accumulated)
             else:
-                self.running_spans[span][0] = self.done_spans[span] + accumulated
+                self.running_spans.set(span, self.done_spans[span] + accumulated)
 
     #-------------------------------------------------------------------------------
     def rolloverSpan(self, span):
-        for i in range(k_periodRange[span]-1,0,-1):
-            self.running_spans[span][i] = self.running_spans[span][i-1]
-        self.running_spans[span][0] = 0
+        if self.archiveSpans and span != 'c':
+            # keep every completed span, not just the slots the states have room for
+            try:
+                append_span_archive(self.plugin.archiveFolder, self.id, self.spanNames[span], self.start_spans[span], self.running_spans.get(span))
+            except OSError as e:
+                self.logger.error(f'"{self.name}" span archive error \n{e}')
+        self.running_spans.rollover(span)
 
     #-------------------------------------------------------------------------------
     def saveSpanStates(self):
@@ -1401,20 +2847,39 @@ class RunningTimer(TimerBase):
         self.states['zzzSaveSpanDict'] = repr(self.save_spans)
         #done_spans
         self.states['zzzSecsDoneDict'] = repr(self.done_spans)
-        # running_spans
-        for span, name in k_timeSpans.items():
-            for i in range(k_periodRange[span]):
-                self.states[f'seconds{name}{i:02}'] = int(round(self.running_spans[span][i]))
-                self.states[f'string{name}{i:02}'] = format_seconds(self.running_spans[span][i])
+        # running_spans, only as much as the state profile exposes
+        for span, slots in self.spanSlots:
+            name = self.spanNames[span]
+            for i in range(slots):
+                self.states[f'seconds{name}{i:02}'] = int(round(self.running_spans.get(span, i)))
+                if self.spanStrings:
+                    self.states[f'string{name}{i:02}'] = format_seconds(self.running_spans.get(span, i))
 
             # FIXME depricated state names
             # remove after respectful transition period
-            self.states[f'secondsThis{name}'] = int(round(self.running_spans[span][0]))
-            self.states[f'stringThis{name}']  = format_seconds(self.running_spans[span][0])
-            self.states[f'secondsLast{name}'] = int(round(self.running_spans[span][1]))
-            self.states[f'stringLast{name}']  = format_seconds(self.running_spans[span][1])
+            if self.spanLegacy and span in k_timeSpans:
+                self.states[f'secondsThis{name}'] = int(round(self.running_spans.get(span, 0)))
+                self.states[f'stringThis{name}']  = format_seconds(self.running_spans.get(span, 0))
+                self.states[f'secondsLast{name}'] = int(round(self.running_spans.get(span, 1)))
+                self.states[f'stringLast{name}']  = format_seconds(self.running_spans.get(span, 1))
             # /FIXME
 
+        # published for aggregates: on state and current seconds for each calendar span
+        self.spanTotals = (self.onState, tuple(self.running_spans.get(span) for span in k_cycleSpans))
+
+        # cycle_stats
+        self.states['zzzCycleStats'] = repr(self.cycle_stats)
+        if self.cycleStats:
+            for span in k_cycleSpans:
+                name = k_timeSpans[span]
+                count, low, high, mean = self.cycle_stats.get(span)
+                elapsed = self.taskTime - self.start_spans[span]
+                self.states[f'cycleCount{name}'] = count
+                self.states[f'cycleMin{name}']   = int(round(low))
+                self.states[f'cycleMax{name}']   = int(round(high))
+                self.states[f'cycleMean{name}']  = int(round(mean))
+                self.states[f'dutyCycle{name}']  = round(100*self.running_spans.get(span)/elapsed, 1) if elapsed > 0 else 0
+
         self.update()
 
     #-------------------------------------------------------------------------------
@@ -1431,6 +2896,949 @@ class RunningTimer(TimerBase):
         else:
             self.displayState = self.state
 
+################################################################################
+class SequenceTimer(TimerBase):
+    __slots__ = ('steps', 'stepInputs', 'partials', 'offDelta', 'strict')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, instance, plugin):
+        super(SequenceTimer, self).__init__(instance, plugin)
+
+        # partials: next step index -> deadline for that step
+        self.partials = dict()
+
+        # initial state
+        self.deadline = 0
+        self.tick()
+
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(SequenceTimer, self).configure(props)
+
+        self.strict   = props.get('strictOrder',False)
+        self.offDelta = self.delta( props.get('offCycles',10),
+                                    props.get('offUnits','seconds') )
+
+        # steps: ordered (devId, stateKey, seconds allowed since prior step)
+        self.steps = list()
+        for i, (deviceKey, stateKey) in enumerate(k_deviceKeys[:k_sequenceSteps]):
+            if zint(props.get(deviceKey,'')):
+                limit = 0
+                if i:
+                    limit = self.delta( props.get(f'stepCycles{i+1}',10),
+                                        props.get('stepUnits','seconds') )
+                self.steps.append((int(props[deviceKey]), props[stateKey], limit))
+        self.stepInputs = set((devId, stateKey) for devId, stateKey, limit in self.steps)
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        # step numbers no longer refer to the same inputs
+        self.partials = dict()
+        self.setProgress()
+
+    #-------------------------------------------------------------------------------
+    # properties
+    #-------------------------------------------------------------------------------
+    def _offTimeGet(self):
+        return self.states['offTime']
+    def _offTimeSet(self, value):
+        self.states['offTime'] = value
+        self.states['offString'] = format_datetime(value)
+    offTime = property(_offTimeGet, _offTimeSet)
+
+    def _matchTimeGet(self):
+        return self.states['matchTime']
+    def _matchTimeSet(self, value):
+        self.states['matchTime'] = value
+        self.states['matchString'] = format_datetime(value)
+    matchTime = property(_matchTimeGet, _matchTimeSet)
+
+    def _matchCountGet(self):
+        return self.states['matchCount']
+    def _matchCountSet(self, value):
+        self.states['matchCount'] = value
+    matchCount = property(_matchCountGet, _matchCountSet)
+
+    def _stepGet(self):
+        return self.states['step']
+    def _stepSet(self, value):
+        self.states['step'] = value
+    step = property(_stepGet, _stepSet)
+
+    def _deadlineGet(self):
+        return self.states['deadline']
+    def _deadlineSet(self, value):
+        self.states['deadline'] = value
+    deadline = property(_deadlineGet, _deadlineSet)
+
+    #-------------------------------------------------------------------------------
+    def tick(self):
+        logTimer = None
+        if self.partials and self.taskTime > self.deadline:
+            self.expirePartials()
+            logTimer = 'deadline'
+        if self.onState and self.taskTime >= self.offTime:
+            self.onState = False
+            self.queueEvent('timerExpired')
+            logTimer = 'offTime'
+        if logTimer:
+            self.trace('timer:%s [onOff:%s, step:%s, matches:%s]', logTimer, self.onState, self.step, self.matchCount)
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def tock(self, newVal):
+        # manual input without a step (e.g. from an action) is treated as a full match
+        if newVal:
+            self.match()
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def turnOn(self):
+        self.onState = True
+        self.offTime = self.taskTime + self.offDelta
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def turnOff(self):
+        self.partials = dict()
+        self.setProgress()
+        if self.onState:
+            self.onState = False
+            self.offTime = self.taskTime
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def getStates(self):
+        if self.onState:
+            self.state = 'matched'
+            self.stateImg = 'SensorOn'
+        elif self.partials:
+            self.state = 'partial'
+            self.stateImg = 'TimerOff'
+        else:
+            self.state = 'idle'
+            self.stateImg = 'SensorOff'
+
+        self.displayState = self.state
+        if self.plugin.showTimer:
+            if self.state == 'matched':
+                self.displayState = format_seconds(self.offTime - self.taskTime)
+            elif self.state == 'partial':
+                self.displayState = f'{self.step}/{len(self.steps)} {format_seconds(self.deadline - self.taskTime)}'
+
+    #-------------------------------------------------------------------------------
+    def advance(self, stepInput):
+        partials = dict()
+        matched = False
+        for index, deadline in self.partials.items():
+            if self.taskTime > deadline:
+                continue
+            devId, stateKey, limit = self.steps[index]
+            if (devId, stateKey) == stepInput:
+                index += 1
+                if index == len(self.steps):
+                    matched = True
+                    continue
+                deadline = self.taskTime + self.steps[index][2]
+            elif self.strict:
+                continue
+            partials[index] = max(deadline, partials.get(index,0))
+        devId, stateKey, limit = self.steps[0]
+        if (devId, stateKey) == stepInput:
+            if len(self.steps) == 1:
+                matched = True
+            else:
+                partials[1] = self.taskTime + self.steps[1][2]
+        self.partials = partials
+        self.setProgress()
+        if matched:
+            self.match()
+        self.trace('input processed:%s [onOff:%s, step:%s, matches:%s]', stepInput, self.onState, self.step, self.matchCount)
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def match(self):
+        self.matchCount += 1
+        self.matchTime = self.taskTime
+        self.onState = True
+        self.offTime = self.taskTime + self.offDelta
+
+    #-------------------------------------------------------------------------------
+    def expirePartials(self):
+        self.partials = {index:deadline for index, deadline in self.partials.items() if self.taskTime <= deadline}
+        self.setProgress()
+
+    #-------------------------------------------------------------------------------
+    def setProgress(self):
+        if self.partials:
+            self.step = max(self.partials)
+            self.deadline = min(self.partials.values())
+        else:
+            self.step = 0
+            self.deadline = 0
+
+    #-------------------------------------------------------------------------------
+    # override base class methods
+    #-------------------------------------------------------------------------------
+    def devChanged(self, oldDev, newDev):
+        if newDev.id in self.deviceStateDict:
+            for devId, stateKey in self.stepInputs:
+                if devId == newDev.id:
+                    value = newDev.states[stateKey]
+                    result = self.doInputComparison(oldDev.states[stateKey], value, (devId, stateKey))
+                    self.trace('devChanged:"%s" [state:%s, value:%r, result:%s]', newDev.name, stateKey, value, result, verbose=True)
+                    if result:
+                        self.advance((devId, stateKey))
+
+    #-------------------------------------------------------------------------------
+    def varChanged(self, oldVar, newVar):
+        pass
+
+################################################################################
+class RunningAggregate(TimerBase):
+    """Fleet totals of a group of running timers, kept in step with each member's saves"""
+    __slots__ = ('contributions', 'totals', 'maxima', 'countOn')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, instance, plugin):
+        super(RunningAggregate, self).__init__(instance, plugin)
+        self.inputsChanged()
+
+    #-------------------------------------------------------------------------------
+    def configure(self, props):
+        super(RunningAggregate, self).configure(props)
+
+        memberIds = set(zint(devId) for devId in props.get('members',[]))
+        if 0 in memberIds:
+            memberIds = set(devId for devId, device in self.plugin.deviceDict.items() if isinstance(device, RunningTimer))
+        # members are reached through the plugin's in-process propagation
+        self.deviceStateDict = {devId:('onOffState',) for devId in memberIds}
+        self.variableList    = list()
+        self.ingestPolicy    = 'none'
+
+    #-------------------------------------------------------------------------------
+    def reconfigure(self, props):
+        # members may have restarted with new totals even if the selection is unchanged
+        self.configure(props)
+        self.inputsChanged()
+        self.trace('reconfigured')
+
+    #-------------------------------------------------------------------------------
+    def inputsChanged(self):
+        # contributions: member id -> (onState, current seconds for each span in k_cycleSpans)
+        self.contributions = dict()
+        self.totals  = array('d', [0.0]*len(k_cycleSpans))
+        self.maxima  = array('d', [0.0]*len(k_cycleSpans))
+        self.countOn = 0
+        for devId in self.deviceStateDict:
+            self.contribute(devId)
+        self.saveStates()
+
+    #-------------------------------------------------------------------------------
+    def contribute(self, devId):
+        """Swap a member's previous contribution for its latest published totals"""
+        oldOn, oldValues = self.contributions.pop(devId, (False, (0.0,)*len(k_cycleSpans)))
+        newOn, newValues = getattr(self.plugin.deviceDict.get(devId), 'spanTotals', None) or (False, None)
+        if newValues is not None:
+            self.contributions[devId] = (newOn, newValues)
+        else:
+            newValues = (0.0,)*len(k_cycleSpans)
+
+        self.countOn += int(newOn) - int(oldOn)
+        rescan = False
+        for i, (oldValue, newValue) in enumerate(zip(oldValues, newValues)):
+            self.totals[i] += newValue - oldValue
+            if newValue >= self.maxima[i]:
+                self.maxima[i] = newValue
+            elif oldValue >= self.maxima[i]:
+                # the largest member shrank, usually a span rollover
+                rescan = True
+        if rescan:
+            for i in range(len(k_cycleSpans)):
+                self.maxima[i] = max((values[i] for onState, values in self.contributions.values()), default=0.0)
+
+    #-------------------------------------------------------------------------------
+    def saveStates(self):
+        self.onState = self.countOn > 0
+        self.states['memberCount'] = len(self.contributions)
+        self.states['countOn'] = self.countOn
+        for i, span in enumerate(k_cycleSpans):
+            name = k_timeSpans[span]
+            self.states[f'secondsTotal{name}'] = int(round(self.totals[i]))
+            self.states[f'stringTotal{name}']  = format_seconds(self.totals[i])
+            self.states[f'secondsMax{name}']   = int(round(self.maxima[i]))
+        self.update()
+
+    #-------------------------------------------------------------------------------
+    def tick(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def turnOn(self):
+        # state follows the members, there is nothing to force
+        self.trace('ignored turnOn')
+
+    #-------------------------------------------------------------------------------
+    def turnOff(self):
+        self.trace('ignored turnOff')
+
+    #-------------------------------------------------------------------------------
+    def getStates(self):
+        if self.onState:
+            self.state = 'on'
+            self.stateImg = 'TimerOn'
+        else:
+            self.state = 'off'
+            self.stateImg = 'SensorOff'
+        self.displayState = f'{self.countOn}/{len(self.contributions)} on'
+
+    #-------------------------------------------------------------------------------
+    # override base class methods
+    #-------------------------------------------------------------------------------
+    def devChanged(self, oldDev, newDev):
+        if newDev.id in self.deviceStateDict:
+            self.trace('devChanged:"%s"', newDev.name, verbose=True)
+            self.contribute(newDev.id)
+            self.saveStates()
+
+    #-------------------------------------------------------------------------------
+    def varChanged(self, oldVar, newVar):
+        pass
+
+################################################################################
+class ExpressionNode(object):
+    """One compiled sub-expression with the input names it depends on"""
+    __slots__ = ('op', 'children', 'name', 'deps', 'value')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, op=None, children=(), name=None, value=None):
+        self.op       = op
+        self.children = children
+        self.name     = name
+        self.value    = value
+        if name:
+            self.deps = frozenset([name])
+        else:
+            self.deps = frozenset().union(*[child.deps for child in children])
+
+################################################################################
+class Expression(object):
+    """Boolean or arithmetic expression over named inputs, re-evaluated incrementally"""
+    __slots__ = ('text', 'root', 'values', 'deviceInputs', 'variableInputs', 'result', 'stale')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, text, props):
+        self.text = text.strip()
+
+        # inputs are named by their config slot
+        self.deviceInputs   = dict()
+        self.variableInputs = dict()
+        names = set()
+        for deviceKey, stateKey in k_deviceKeys:
+            if zint(props.get(deviceKey,'')):
+                self.deviceInputs.setdefault(int(props[deviceKey]), []).append((props.get(stateKey,''), deviceKey))
+                names.add(deviceKey)
+        for variableKey in k_variableKeys:
+            if zint(props.get(variableKey,'')):
+                self.variableInputs.setdefault(int(props[variableKey]), []).append(variableKey)
+                names.add(variableKey)
+
+        if not self.text:
+            raise ValueError("Required")
+        try:
+            tree = ast.parse(self.text, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Syntax error: {e.msg}")
+        self.values = dict()
+        self.root   = self.compile(tree.body, names)
+        self.result = False
+        self.stale  = True
+
+    #-------------------------------------------------------------------------------
+    def compile(self, node, names):
+        if isinstance(node, ast.BoolOp):
+            return ExpressionNode(k_expressionOps[type(node.op)], [self.compile(v, names) for v in node.values])
+        elif isinstance(node, (ast.UnaryOp, ast.BinOp)) and type(node.op) in k_expressionOps:
+            if isinstance(node, ast.UnaryOp):
+                children = [self.compile(node.operand, names)]
+            else:
+                children = [self.compile(node.left, names), self.compile(node.right, names)]
+            return ExpressionNode(k_expressionOps[type(node.op)], children)
+        elif isinstance(node, ast.Compare):
+            ops = [k_expressionOps[type(op)] for op in node.ops if type(op) in k_expressionOps]
+            if len(ops) != len(node.ops):
+                raise ValueError("Unsupported comparison")
+            children = [self.compile(v, names) for v in [node.left] + node.comparators]
+            def compare(*values):
+                return all(op(values[i], values[i+1]) for i, op in enumerate(ops))
+            return ExpressionNode(compare, children)
+        elif isinstance(node, ast.Name):
+            if node.id not in names:
+                raise ValueError(f'Unknown input "{node.id}"')
+            self.values[node.id] = None
+            return ExpressionNode(name=node.id)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float, str)):
+            return ExpressionNode(value=input_value(node.value))
+        raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+
+    #-------------------------------------------------------------------------------
+    def load(self):
+        """Read current values of all inputs and evaluate the whole expression"""
+        for devId, inputs in self.deviceInputs.items():
+            dev = indigo.devices[devId]
+            for stateKey, name in inputs:
+                self.values[name] = input_value(dev.states.get(stateKey))
+        for varId, inputs in self.variableInputs.items():
+            var = indigo.variables[varId]
+            for name in inputs:
+                self.values[name] = input_value(var.value)
+        self.result = self.evaluate(self.root, None)
+
+    #-------------------------------------------------------------------------------
+    def devChanged(self, newDev):
+        changed = set()
+        for stateKey, name in self.deviceInputs.get(newDev.id, ()):
+            value = input_value(newDev.states.get(stateKey))
+            if value != self.values.get(name):
+                self.values[name] = value
+                changed.add(name)
+        return self.update(changed)
+
+    #-------------------------------------------------------------------------------
+    def varChanged(self, newVar):
+        changed = set()
+        for name in self.variableInputs.get(newVar.id, ()):
+            value = input_value(newVar.value)
+            if value != self.values.get(name):
+                self.values[name] = value
+                changed.add(name)
+        return self.update(changed)
+
+    #-------------------------------------------------------------------------------
+    def update(self, changed):
+        """Return the new result if it changed, otherwise None"""
+        if changed & self.root.deps:
+            result = self.evaluate(self.root, None if self.stale else changed)
+            if result != self.result:
+                self.result = result
+                return result
+        return None
+
+    #-------------------------------------------------------------------------------
+    def evaluate(self, node, changed):
+        try:
+            result = bool(self.evaluateNode(node, changed))
+            self.stale = False
+        except (TypeError, ValueError, ArithmeticError):
+            # cached sub-expressions may be incomplete, so start over next time
+            result = False
+            self.stale = True
+        return result
+
+    #-------------------------------------------------------------------------------
+    def evaluateNode(self, node, changed):
+        # only sub-expressions depending on a changed input are recomputed
+        if node.op is None:
+            if node.name:
+                node.value = self.values[node.name]
+        elif changed is None or (changed & node.deps):
+            node.value = node.op(*[self.evaluateNode(child, changed) for child in node.children])
+        return node.value
+
+################################################################################
+class EntityIndex(object):
+    """Names, folders and types of devices or variables, kept current from server notifications"""
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, collection):
+        self.collection = collection
+        self.entries    = None   # id -> (name, folderId, typeName)
+        self.ordered    = None   # entries sorted by name, rebuilt after changes
+        self.stateCache = dict() # device id -> state keys
+
+    #-------------------------------------------------------------------------------
+    def load(self):
+        self.entries = {entity.id:self.entry(entity) for entity in self.collection.iter()}
+        self.ordered = None
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def entry(entity):
+        typeName = f'{type(entity).__name__} {getattr(entity, "deviceTypeId", "")}'.lower()
+        return (entity.name, entity.folderId, typeName)
+
+    #-------------------------------------------------------------------------------
+    def add(self, entity):
+        if self.entries is not None:
+            self.entries[entity.id] = self.entry(entity)
+            self.ordered = None
+
+    #-------------------------------------------------------------------------------
+    def remove(self, entityId):
+        self.stateCache.pop(entityId, None)
+        if self.entries is not None and self.entries.pop(entityId, None):
+            self.ordered = None
+
+    #-------------------------------------------------------------------------------
+    def update(self, entity):
+        # called for every state change, so only compare what the index holds
+        if self.entries is not None:
+            entry = self.entries.get(entity.id)
+            if entry is None or entry[0] != entity.name or entry[1] != entity.folderId:
+                self.add(entity)
+        keys = self.stateCache.get(entity.id)
+        if keys is not None and (len(keys) != len(entity.states) or any(key not in entity.states for key in keys)):
+            del self.stateCache[entity.id]
+
+    #-------------------------------------------------------------------------------
+    def items(self, search='', excludeId=0, keepIds=()):
+        """(id, name) pairs matching comma-separated 'folder:', 'type:' and name prefix terms"""
+        if self.entries is None:
+            self.load()
+        if self.ordered is None:
+            self.ordered = sorted(self.entries.items(), key=lambda item: item[1][0].lower())
+
+        folderIds = typeNames = prefixes = None
+        for term in search.split(','):
+            term = term.strip().lower()
+            if term.startswith('folder:'):
+                name = term[7:].strip()
+                if name:
+                    folderIds = (folderIds or set()) | {folder.id for folder in self.collection.folders if folder.name.lower().startswith(name)}
+            elif term.startswith('type:'):
+                if term[5:].strip():
+                    typeNames = (typeNames or []) + [term[5:].strip()]
+            elif term:
+                prefixes = (prefixes or []) + [term]
+
+        itemList = list()
+        for entityId, (name, folderId, typeName) in self.ordered:
+            if entityId == excludeId:
+                continue
+            if entityId not in keepIds:
+                if folderIds is not None and folderId not in folderIds:
+                    continue
+                if typeNames is not None and not any(t in typeName for t in typeNames):
+                    continue
+                if prefixes is not None and not name.lower().startswith(tuple(prefixes)):
+                    continue
+            itemList.append((entityId, name))
+        return itemList
+
+    #-------------------------------------------------------------------------------
+    def stateKeys(self, devId):
+        if not devId:
+            return ()
+        keys = self.stateCache.get(devId)
+        if keys is None:
+            try:
+                keys = self.stateCache[devId] = tuple(self.collection[devId].states)
+            except KeyError:
+                keys = ()
+        return keys
+
+################################################################################
+class TimeWindow(object):
+    """Daily period bounded by times of day or sunrise and sunset offsets"""
+    __slots__ = ('plugin', 'edges', 'sunTimes')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, props, plugin):
+        self.plugin = plugin
+        # edges: (type, (hour, minute), offset seconds) for start and end
+        self.edges = list()
+        for edge in ['Start','End']:
+            edgeType = props.get(f'window{edge}Type','time')
+            clock = (0, 0)
+            if edgeType == 'time':
+                clock = datetime.strptime(props.get(f'window{edge}Time',''), '%H:%M').timetuple()[3:5]
+            self.edges.append((edgeType, clock, int(props.get(f'window{edge}Offset','') or 0) * 60))
+        # sunTimes: date -> (sunrise, sunset), only the days around now are kept
+        self.sunTimes = dict()
+
+    #-------------------------------------------------------------------------------
+    def boundary(self, edge, day):
+        edgeType, (hour, minute), offset = edge
+        if edgeType == 'time':
+            return time.mktime((day.year, day.month, day.day, hour, minute, 0, 0, 0, -1))
+        if day not in self.sunTimes:
+            if len(self.sunTimes) > 4:
+                self.sunTimes.clear()
+            self.sunTimes[day] = sun_times(day, *self.plugin.getLocation())
+        sunrise, sunset = self.sunTimes[day]
+        return (sunrise if edgeType == 'sunrise' else sunset) + offset
+
+    #-------------------------------------------------------------------------------
+    def state(self, now):
+        """Whether the window is open at now, and the next time that may change"""
+        isOpen = False
+        changes = list()
+        today = date.fromtimestamp(now)
+        for day in [today - timedelta(days=1), today, today + timedelta(days=1)]:
+            start = self.boundary(self.edges[0], day)
+            end   = self.boundary(self.edges[1], day)
+            if end <= start:
+                # closes the next day
+                end = self.boundary(self.edges[1], day + timedelta(days=1))
+            isOpen = isOpen or (start <= now < end)
+            changes.extend([start, end])
+        return isOpen, min(change for change in changes if change > now)
+
+################################################################################
+class InputPredicate(object):
+    """One input and comparison, evaluated with the first subscriber's settings for all of them"""
+    __slots__ = ('inputId', 'stateKey', 'owner', 'subscribers', 'memory')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, inputId, stateKey, owner, memory=None):
+        self.inputId     = inputId
+        self.stateKey    = stateKey
+        self.owner       = owner
+        self.subscribers = list()
+        # hysteresis memory belongs to the comparison, not the owner, which may differ after a rebuild
+        self.memory      = dict() if memory is None else memory
+
+    #-------------------------------------------------------------------------------
+    def evaluate(self, old, new):
+        if self.stateKey is None:
+            return self.owner.doInputComparison(old.value, new.value, self.inputId, self.memory)
+        return self.owner.doInputComparison(old.states[self.stateKey], new.states[self.stateKey], (self.inputId, self.stateKey), self.memory)
+
+################################################################################
+class ShadowStates(dict):
+    """Plain dict with the iteritems that timers expect of indigo.Dict"""
+
+    #-------------------------------------------------------------------------------
+    def iteritems(self):
+        return iter(list(self.items()))
+
+################################################################################
+class ShadowDevice(object):
+    """Stand-in device for a shadow timer, keeping its states in memory and comparing them to the live timer"""
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, dev, states, props, overrides, index):
+        self.id           = dev.id
+        self.name         = f'{dev.name} [shadow {index}]'
+        self.folderId     = dev.folderId
+        self.pluginId     = dev.pluginId
+        self.deviceTypeId = dev.deviceTypeId
+        self.pluginProps  = props
+        self.overrides    = overrides
+        self.stateDict    = ShadowStates(states)
+
+        # (time, live on, shadow on) each time either changes
+        self.timeline        = deque(maxlen=k_traceSize)
+        self.last            = None
+        self.divergences     = 0
+        self.divergedSeconds = 0.0
+        self.since           = None
+
+    #-------------------------------------------------------------------------------
+    @property
+    def states(self):
+        return ShadowStates(self.stateDict)
+
+    #-------------------------------------------------------------------------------
+    def updateStatesOnServer(self, newStates):
+        for item in newStates:
+            self.stateDict[item['key']] = item['value']
+
+    #-------------------------------------------------------------------------------
+    def updateStateImageOnServer(self, image):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def compare(self, liveOn, shadowOn, t):
+        pair = (liveOn, shadowOn)
+        if pair != self.last:
+            self.timeline.append((t, liveOn, shadowOn))
+            if liveOn != shadowOn and self.since is None:
+                self.divergences += 1
+                self.since = t
+            elif liveOn == shadowOn and self.since is not None:
+                self.divergedSeconds += t - self.since
+                self.since = None
+            self.last = pair
+
+################################################################################
+class DeviceSnapshot(object):
+    """Stand-in for a timer device passed directly to downstream timers"""
+    __slots__ = ('id', 'name', 'pluginId', 'states')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, dev, states):
+        self.id       = dev.id
+        self.name     = dev.name
+        self.pluginId = dev.pluginId
+        self.states   = dict(states)
+
+################################################################################
+class EventCapture(object):
+    """Input changes packed into a buffer by the dispatching thread and written to rotating files each tick"""
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, path, maxBytes, backups):
+        self.path     = path
+        self.maxBytes = maxBytes
+        self.backups  = backups
+        # the lock covers the buffer and the file, which are shared by the dispatching and concurrent threads
+        self.lock     = threading.Lock()
+        self.buffer   = bytearray()
+        self.closed   = False
+        # records written and dropped, bytes written and seconds spent packing records
+        self.records  = 0
+        self.dropped  = 0
+        self.bytes    = 0
+        self.seconds  = 0.0
+        self.file     = open(path, 'ab')
+        if not self.file.tell():
+            self.file.write(k_captureMagic)
+
+    #-------------------------------------------------------------------------------
+    def add(self, kind, inputId, changes):
+        start = time.perf_counter()
+        now = time.time()
+        packed = bytearray()
+        for key, old, new in changes:
+            key, old, new = key.encode()[:255], repr(old).encode()[:65535], repr(new).encode()[:65535]
+            packed += k_captureRecord.pack(now, inputId, kind, len(key), len(old), len(new)) + key + old + new
+        with self.lock:
+            if self.closed:
+                return
+            elif len(self.buffer) + len(packed) > k_captureBuffer:
+                self.dropped += len(changes)
+            else:
+                self.buffer += packed
+                self.records += len(changes)
+        self.seconds += time.perf_counter() - start
+
+    #-------------------------------------------------------------------------------
+    def flush(self):
+        with self.lock:
+            self.write()
+
+    #-------------------------------------------------------------------------------
+    def write(self):
+        # callers hold the lock
+        if self.buffer and not self.closed:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.bytes += len(self.buffer)
+            self.buffer = bytearray()
+            if self.file.tell() >= self.maxBytes:
+                self.rotate()
+
+    #-------------------------------------------------------------------------------
+    def rotate(self):
+        # callers hold the lock; path.1 is the newest backup, like logging.handlers.RotatingFileHandler
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i+1}')
+        os.replace(self.path, f'{self.path}.1')
+        self.file = open(self.path, 'ab')
+        self.file.write(k_captureMagic)
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            self.write()
+            self.closed = True
+            self.file.close()
+
+################################################################################
+class ProfileWindow(object):
+    """cProfile collection across the plugin's threads for a fixed number of seconds"""
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, seconds, path):
+        self.until    = time.time() + seconds
+        self.path     = path
+        self.lock     = threading.Lock()
+        # profiles: thread ident -> cProfile.Profile, or 0 -> the one shared profile
+        self.profiles = dict()
+        if k_sharedProfile:
+            self.profiles[0] = cProfile.Profile()
+            self.profiles[0].enable()
+
+    #-------------------------------------------------------------------------------
+    def open(self):
+        return time.time() < self.until
+
+    #-------------------------------------------------------------------------------
+    def finished(self, now):
+        # calls started just before the window closed get one tick to return
+        return now >= self.until + k_tickSeconds
+
+    #-------------------------------------------------------------------------------
+    def runcall(self, func, *args, **kwargs):
+        if k_sharedProfile:
+            return func(*args, **kwargs)
+        ident = threading.get_ident()
+        with self.lock:
+            profile = self.profiles.get(ident)
+            if profile is None:
+                profile = self.profiles[ident] = cProfile.Profile()
+        return profile.runcall(func, *args, **kwargs)
+
+    #-------------------------------------------------------------------------------
+    def stats(self):
+        """All threads' profiles merged, or None if nothing ran"""
+        with self.lock:
+            profiles = list(self.profiles.values())
+        if k_sharedProfile:
+            profiles[0].disable()
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # a profile that never completed a call has no stats
+                pass
+        return stats
+
+################################################################################
+class SpanValues(object):
+    """One number per span, indexed by span like a dict but packed in one array"""
+    __slots__ = ('data', 'index')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, typecode, saved=None, spans=None):
+        saved = saved or dict()
+        self.index = {span:i for i, span in enumerate(spans)} if spans else k_spanIndex
+        self.data = array(typecode, (saved.get(span) or 0 for span in self.index))
+
+    #-------------------------------------------------------------------------------
+    def __repr__(self):
+        # saved to hidden states, read back with literal_eval
+        return repr(dict(zip(self.index, self.data)))
+
+    #-------------------------------------------------------------------------------
+    def __getitem__(self, span):
+        return self.data[self.index[span]]
+
+    #-------------------------------------------------------------------------------
+    def __setitem__(self, span, value):
+        self.data[self.index[span]] = value
+
+################################################################################
+class SpanHistory(object):
+    """Accumulated seconds for the current and prior slots of every span, packed in one array"""
+    __slots__ = ('data', 'offsets', 'ranges')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, states, layout=None):
+        # layout: (span, name, slots) for each span kept, by default the calendar spans
+        if layout:
+            self.ranges  = {span:slots for span, name, slots in layout}
+            self.offsets = dict(zip(self.ranges, itertools.accumulate([0] + list(self.ranges.values()))))
+        else:
+            self.ranges  = k_periodRange
+            self.offsets = k_spanOffsets
+            layout = tuple((span, name, k_periodRange[span]) for span, name in k_timeSpans.items())
+        self.data = array('d', (states.get(f'seconds{name}{i:02}', 0) for span, name, slots in layout for i in range(slots)))
+
+    #-------------------------------------------------------------------------------
+    def get(self, span, index=0):
+        return self.data[self.offsets[span]+index]
+
+    #-------------------------------------------------------------------------------
+    def set(self, span, value):
+        self.data[self.offsets[span]] = value
+
+    #-------------------------------------------------------------------------------
+    def rollover(self, span):
+        i = self.offsets[span]
+        j = i + self.ranges[span]
+        self.data[i+1:j] = self.data[i:j-1]
+        self.data[i] = 0.0
+
+################################################################################
+class CustomSpan(object):
+    """User defined span of a whole number of hours or months from an anchor time"""
+    __slots__ = ('name', 'rule', 'anchor', 'period', 'slots', 'start', 'end')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, props, n):
+        self.name   = props[f'customName{n}']
+        self.rule   = props[f'customRule{n}']
+        self.anchor = datetime.strptime(props[f'customAnchor{n}'], '%Y-%m-%d %H:%M')
+        self.period = int(props[f'customPeriod{n}'])
+        self.slots  = min(int(props[f'customSlots{n}']), k_customRange)
+        self.start  = self.end = 0.0
+
+    #-------------------------------------------------------------------------------
+    def locate(self, t):
+        """Set the start and end of the span containing epoch time t, in local wall clock time"""
+        now = datetime.fromtimestamp(t)
+        if self.rule == 'hours':
+            step  = timedelta(hours=self.period)
+            start = self.anchor + step * math.floor((now - self.anchor) / step)
+            end   = start + step
+        else:
+            k = ((now.year - self.anchor.year)*12 + now.month - self.anchor.month) // self.period
+            if self.monthStart(k) > now:
+                k -= 1
+            start = self.monthStart(k)
+            end   = self.monthStart(k+1)
+        self.start = time.mktime(start.timetuple())
+        self.end   = time.mktime(end.timetuple())
+
+    #-------------------------------------------------------------------------------
+    def monthStart(self, k):
+        # the anchor day, or the last day of shorter months
+        year, month = divmod(self.anchor.year*12 + self.anchor.month - 1 + k*self.period, 12)
+        day = min(self.anchor.day, calendar.monthrange(year, month+1)[1])
+        return self.anchor.replace(year=year, month=month+1, day=day)
+
+################################################################################
+class CycleStats(object):
+    """Count, total, min and max on-cycle seconds for each span, packed in one array"""
+    __slots__ = ('data',)
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, saved=None):
+        size = len(k_cycleSpans)*len(k_cycleFields)
+        if saved and len(saved) == size:
+            self.data = array('d', saved)
+        else:
+            self.data = array('d', [0.0]*size)
+
+    #-------------------------------------------------------------------------------
+    def __repr__(self):
+        return repr(self.data.tolist())
+
+    #-------------------------------------------------------------------------------
+    def add(self, spanSeconds):
+        """Record a completed cycle, given its seconds within each span of k_cycleSpans"""
+        data = self.data
+        for i, seconds in zip(range(0, len(data), len(k_cycleFields)), spanSeconds):
+            if data[i]:
+                data[i+2] = min(data[i+2], seconds)
+                data[i+3] = max(data[i+3], seconds)
+            else:
+                data[i+2] = data[i+3] = seconds
+            data[i]   += 1
+            data[i+1] += seconds
+
+    #-------------------------------------------------------------------------------
+    def reset(self, span):
+        if span in k_cycleSpans:
+            i = k_cycleSpans.index(span)*len(k_cycleFields)
+            for j in range(len(k_cycleFields)):
+                self.data[i+j] = 0.0
+
+    #-------------------------------------------------------------------------------
+    def get(self, span):
+        i = k_cycleSpans.index(span)*len(k_cycleFields)
+        count, total, low, high = self.data[i:i+len(k_cycleFields)]
+        mean = total/count if count else 0.0
+        return int(count), low, high, mean
+
 ################################################################################
 # Utilities
 ################################################################################
@@ -1439,6 +3847,244 @@ def zint(value):
     try: return int(value)
     except: return 0
 
+#-------------------------------------------------------------------------------
+def sun_times(day, latitude, longitude):
+    """Sunrise and sunset epoch times for a date by the sunrise equation, both at solar noon in polar night"""
+    n = (day - date(2000,1,1)).days - longitude/360.0
+    anomaly = math.radians((357.5291 + 0.98560028*n) % 360)
+    center = 1.9148*math.sin(anomaly) + 0.0200*math.sin(2*anomaly) + 0.0003*math.sin(3*anomaly)
+    ecliptic = math.radians((math.degrees(anomaly) + center + 180 + 102.9372) % 360)
+    transit = n + 0.0053*math.sin(anomaly) - 0.0069*math.sin(2*ecliptic)
+    declination = math.asin(math.sin(ecliptic) * math.sin(math.radians(23.4397)))
+    latitude = math.radians(latitude)
+    cosHour = (math.sin(math.radians(-0.833)) - math.sin(latitude)*math.sin(declination)) / (math.cos(latitude)*math.cos(declination))
+    halfDay = math.acos(min(1.0, max(-1.0, cosHour))) / (2*math.pi) * 86400
+    noon = k_j2000 + transit*86400
+    return noon - halfDay, noon + halfDay
+
+#-------------------------------------------------------------------------------
+def input_value(value):
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    try: return float(value)
+    except (TypeError, ValueError): pass
+    value = str(value).lower()
+    if value in k_commonTrueStates:  return True
+    if value in k_commonFalseStates: return False
+    return value
+
+#-------------------------------------------------------------------------------
+def approx_size(obj, seen):
+    """Bytes held by an object and everything it references, skipping ids in seen"""
+    if id(obj) in seen or isinstance(obj, (type, type(sys))):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key, seen) + approx_size(value, seen) for key, value in list(obj.items()))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in list(obj))
+    if hasattr(obj, '__dict__'):
+        size += approx_size(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            size += approx_size(getattr(obj, name, None), seen)
+    return size
+
+#-------------------------------------------------------------------------------
+def state_profile(props):
+    """(span, slots) pairs, string states and legacy states a running timer exposes"""
+    profile = props.get('stateProfile','full')
+    if profile in k_stateProfiles:
+        spanSlots, strings, legacy = k_stateProfiles[profile]
+    else:
+        spanSlots = dict()
+        for span, name in k_timeSpans.items():
+            spanSlots[span] = min(zint(props.get(f'stateSlots{name}', k_periodRange[span])), k_periodRange[span])
+        strings = props.get('stateStrings',True)
+        legacy  = props.get('stateLegacy',False)
+    return tuple((span, spanSlots[span]) for span in k_timeSpans if spanSlots.get(span)), strings, legacy
+
+#-------------------------------------------------------------------------------
+def custom_spans(props):
+    """Configured custom spans of a running timer by span key"""
+    customSpans = OrderedDict()
+    for n, span in enumerate(k_customSpans, 1):
+        if props.get(f'customRule{n}','none') != 'none':
+            customSpans[span] = CustomSpan(props, n)
+    return customSpans
+
+#-------------------------------------------------------------------------------
+def span_label(span, index, legacy=False, name=None):
+    name = name or k_timeSpans[span]
+    if span == 'c':
+        return ('Currently', 'Previously')[index]
+    elif legacy:
+        return f'{("This","Last")[index]} {name}'
+    elif index == 0:
+        return f'Current {name}'
+    elif span == 'y':
+        return 'Previous Year'
+    else:
+        return f'{index} {name}{"s" if index > 1 else ""} Ago'
+
+#-------------------------------------------------------------------------------
+def read_timer_file(path):
+    """Timer definitions as dicts of name, type, folder and config props"""
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list()
+            for row in csv.DictReader(f):
+                props = {key:value for key, value in row.items() if key not in k_provisionKeys and value}
+                rows.append(dict({key:row.get(key,'') for key in k_provisionKeys}, props=props))
+        else:
+            rows = json.load(f)
+            if not isinstance(rows, list):
+                raise ValueError("File must contain a list of timers")
+    entries = list()
+    for row in rows:
+        props = dict()
+        for key, value in row.get('props',{}).items():
+            # config dialogs store checkboxes as booleans and everything else as strings
+            if isinstance(value, bool):
+                props[key] = value
+            elif str(value).lower() in ['true','false']:
+                props[key] = str(value).lower() == 'true'
+            else:
+                props[key] = str(value)
+        entries.append({'name':str(row.get('name','')).strip(), 'type':row.get('type',''), 'folder':row.get('folder','') or '', 'props':props})
+    return entries
+
+#-------------------------------------------------------------------------------
+def write_timer_file(path, entries):
+    with open(path, 'w', newline='') as f:
+        if path.lower().endswith('.csv'):
+            propKeys = sorted(set(key for entry in entries for key in entry['props']))
+            writer = csv.DictWriter(f, fieldnames=list(k_provisionKeys) + propKeys)
+            writer.writeheader()
+            for entry in entries:
+                writer.writerow(dict(entry['props'], **{key:entry[key] for key in k_provisionKeys}))
+        else:
+            json.dump(entries, f, indent=2, sort_keys=True)
+
+#-------------------------------------------------------------------------------
+def append_span_archive(folder, devId, name, start, seconds):
+    """Append one completed span to a timer's start and seconds column files"""
+    path = os.path.join(folder, str(devId))
+    os.makedirs(path, exist_ok=True)
+    for column, value in (('start', start), ('seconds', seconds)):
+        with open(os.path.join(path, f'{name}.{column}'), 'ab') as f:
+            f.write(array('d', [value]).tobytes())
+
+#-------------------------------------------------------------------------------
+def read_span_archive(folder, devId, name):
+    """Memory-mapped start and seconds columns of a timer's archived spans"""
+    columns = list()
+    for column in ('start', 'seconds'):
+        try:
+            with open(os.path.join(folder, str(devId), f'{name}.{column}'), 'rb') as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            # missing or empty
+            view = memoryview(b'')
+        columns.append(view[:len(view)//8*8].cast('d'))
+    # a row only counts once both columns have it
+    rows = min(len(columns[0]), len(columns[1]))
+    return columns[0][:rows], columns[1][:rows]
+
+#-------------------------------------------------------------------------------
+def weekday_means(start, seconds):
+    """Mean seconds for each weekday, Monday first, from archived day totals"""
+    totals = [0.0]*7
+    counts = [0]*7
+    i = 0
+    while i < len(start):
+        # local midnights round to whole days across daylight saving changes, so a run of consecutive
+        # days ends where the day count first runs ahead of the row count
+        first = start[i]
+        j = i + bisect.bisect_right(range(i, len(start)), 0, key=lambda k: round((start[k] - first)/86400) - (k-i))
+        # a run steps through the weekdays in order, so each weekday is a strided slice
+        day = time.localtime(first).tm_wday
+        for k in range(min(7, j-i)):
+            run = seconds[i+k:j:7]
+            totals[(day+k) % 7] += sum(run)
+            counts[(day+k) % 7] += len(run)
+        i = j
+    return [total/count if count else 0.0 for total, count in zip(totals, counts)]
+
+#-------------------------------------------------------------------------------
+def month_totals(start, seconds):
+    """(year, month) -> seconds from archived month totals"""
+    totals = dict()
+    i = 0
+    while i < len(start):
+        # start times are in order, so each month is the slice up to the start of the next
+        year, month = time.localtime(start[i])[:2]
+        j = bisect.bisect_left(start, time.mktime((year + month//12, month%12 + 1, 1, 0, 0, 0, 0, 0, -1)), i)
+        totals[(year, month)] = sum(seconds[i:j])
+        i = j
+    return totals
+
+#-------------------------------------------------------------------------------
+def span_total(start, seconds, since):
+    """Seconds from archived spans starting at or after since, start times are in order"""
+    return sum(seconds[bisect.bisect_left(start, since):])
+
+#-------------------------------------------------------------------------------
+def read_capture_file(path):
+    """(time, kind, input id, state key, old repr, new repr) for each record of an event capture file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(k_captureMagic):
+        raise ValueError("Not an event capture file")
+    offset = len(k_captureMagic)
+    while offset + k_captureRecord.size <= len(data):
+        t, inputId, kind, keyLen, oldLen, newLen = k_captureRecord.unpack_from(data, offset)
+        offset += k_captureRecord.size
+        if offset + keyLen + oldLen + newLen > len(data):
+            # torn final record
+            break
+        key = data[offset:offset+keyLen].decode(errors='replace')
+        old = data[offset+keyLen:offset+keyLen+oldLen].decode(errors='replace')
+        new = data[offset+keyLen+oldLen:offset+keyLen+oldLen+newLen].decode(errors='replace')
+        offset += keyLen + oldLen + newLen
+        yield t, kind, inputId, key, old, new
+
+#-------------------------------------------------------------------------------
+def capture_input_name(kind, inputId, key):
+    """Quoted name of a captured device or variable, or its id if it no longer exists, and the state key"""
+    objects = indigo.variables if kind else indigo.devices
+    try:
+        name = f'"{objects[inputId].name}"'
+    except KeyError:
+        name = f'{"variable" if kind else "device"} {inputId}'
+    return f'{name} {key}' if key else name
+
+#-------------------------------------------------------------------------------
+def parse_overrides(text):
+    """Config settings from comma separated key=value pairs, typed like imported timer files"""
+    overrides = dict()
+    for item in text.split(','):
+        if item.strip():
+            key, sep, value = item.partition('=')
+            if not sep or not key.strip():
+                raise ValueError(f'"{item.strip()}" is not key=value')
+            value = value.strip()
+            overrides[key.strip()] = (value.lower() == 'true') if value.lower() in ['true','false'] else value
+    return overrides
+
+#-------------------------------------------------------------------------------
+def format_overrides(overrides):
+    return ', '.join(f'{key}={value}' for key, value in overrides.items())
+
+#-------------------------------------------------------------------------------
+def shadow_props(props, overrides):
+    """Live timer settings with a shadow's overrides, never logging or archiving"""
+    props = dict(props)
+    props.update(overrides)
+    props.update(logOnOff=False, archiveSpans=False)
+    return props
+
 #-------------------------------------------------------------------------------
 def ver(vstr): return tuple(map(int, (vstr.split('.'))))
 